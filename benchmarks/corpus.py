@@ -0,0 +1,243 @@
+"""
+Generate a synthetic docs tree for benchmarking the hooks.
+
+The tree mixes CJK and English prose, fenced code, `\\automata` blocks (some
+drawable without TeX, some not) and one `{{ BEGIN_TOC }}` index page per
+section. With a git history, the pages are committed over several rounds of
+edits, some of them are renamed and one formatting commit is listed in
+.ignored-commits, like the real site does.
+
+    python benchmarks/corpus.py OUT [--pages N] [--cjk RATIO] [--seed N]
+
+writes the tree below OUT together with an mkdocs.yml using the hooks of this
+repository, so that `mkdocs build -f OUT/mkdocs.yml` profiles a whole build.
+Put benchmarks/fake_tex first on PATH to render without TeX. The hooks keep
+the caches and the profile of such a build in OUT/.cache and read the ignore
+rules from OUT/.ignored-commits, so it never touches those of the site.
+"""
+
+import os
+import sys
+import random
+import argparse
+import subprocess
+from typing import NamedTuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+HOOKS = ["theme_override", "linkbackward", "toc", "tikzautomata", "buildprofile"]
+PAGES_PER_TOPIC = 5
+TOPICS_PER_SECTION = 4
+# a Sunday in 2024, the first commit of every generated history
+EPOCH = 1704585600
+
+WORDS = (
+    "the cache of every page is keyed by its source and the hooks read it back "
+    "before rendering while git tracks each rename across the history so that "
+    "update times follow files which moved between sections of the notes"
+).split()
+
+NATIVE_AUTOMATON = r"""\automata
+    \node[state, initial] (q0) {$q_0$};
+    \node[state, accepting] (q1) [right=of q0] {$q_1$};
+    \node[state] (q2) [below=of q0] {$q_{%d}$};
+    \path (q0) edge [bend left] node {a} (q1)
+          (q1) edge [loop above] node {b} (q1)
+          (q0) edge node [swap] {$\epsilon$} (q2)
+          (q2) edge [bend right] node {c} (q1);
+"""
+
+TEX_AUTOMATON = r"""\automata[->, node distance=2cm]
+    \node[state, initial] (q0) {$q_0$};
+    \node[state, accepting] (q1) [right=of q0] {$q_1$};
+    \draw[dashed] (q0) -- (q1) node[midway, above] {%d};
+"""
+
+FENCE = """```python
+def step(state, symbol):
+    # %d
+    return table[state][symbol]
+```
+"""
+
+
+class Corpus(NamedTuple):
+    root: str
+    docs_dir: str
+    # (directory of the page, TOC links) of every index page
+    tocs: list
+    pages: list
+    ignore_commits: list
+
+
+def _cjk(rng: random.Random, n: int) -> str:
+    return "".join(chr(rng.randint(0x4E00, 0x9FA5)) for _ in range(n))
+
+
+def _paragraph(rng: random.Random, cjk: float) -> str:
+    parts = []
+    for _ in range(rng.randint(3, 8)):
+        if rng.random() < cjk:
+            parts.append(_cjk(rng, rng.randint(8, 30)) + "。")
+        else:
+            parts.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))) + ".")
+    return " ".join(parts)
+
+
+def _page(rng: random.Random, title: str, cjk: float, automata: float, n: int) -> str:
+    lines = [f"# {title}", ""]
+    for i in range(rng.randint(3, 10)):
+        lines += [f"## {title} {i}", "", _paragraph(rng, cjk), ""]
+        if rng.random() < 0.5:
+            lines += [FENCE % i, ""]
+        if rng.random() < automata:
+            template = TEX_AUTOMATON if rng.random() < 0.3 else NATIVE_AUTOMATON
+            lines += [template % (n * 100 + i), ""]
+    return "\n".join(lines)
+
+
+def _toc(topics: list) -> str:
+    lines = ["{{ BEGIN_TOC }}"]
+    for topic, pages in topics:
+        lines.append(f"- {topic}:")
+        lines.append(f"  - index: {topic}/")
+        lines.extend(f"  - {page}: {topic}/{page}" for page in pages)
+    lines.append("{{ END_TOC }}")
+    return "\n".join(lines)
+
+
+def _git(root: str, *args: str, timestamp: int = EPOCH) -> str:
+    env = dict(
+        os.environ,
+        GIT_AUTHOR_NAME="bench",
+        GIT_AUTHOR_EMAIL="bench@example.com",
+        GIT_COMMITTER_NAME="bench",
+        GIT_COMMITTER_EMAIL="bench@example.com",
+        GIT_AUTHOR_DATE=f"@{timestamp} +0000",
+        GIT_COMMITTER_DATE=f"@{timestamp} +0000",
+    )
+    return subprocess.run(
+        ["git", *args], cwd=root, env=env, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+def _write(path: str, text: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def generate(
+    root: str,
+    pages: int = 100,
+    cjk: float = 0.5,
+    automata: float = 0.2,
+    seed: int = 0,
+    history: bool = True,
+    rounds: int = 5,
+) -> Corpus:
+    """
+    Write a corpus of roughly the given number of pages below root.
+    """
+    rng = random.Random(seed)
+    docs_dir = os.path.join(root, "docs")
+    written = []
+    tocs = []
+    n = 0
+    section = 0
+    while n < pages:
+        section_dir = os.path.join(docs_dir, f"section{section}")
+        topics = []
+        for t in range(TOPICS_PER_SECTION):
+            names = []
+            for p in range(PAGES_PER_TOPIC):
+                if n >= pages:
+                    break
+                name = f"page{p}"
+                path = os.path.join(section_dir, f"topic{t}", f"{name}.md")
+                _write(path, _page(rng, f"Page {n}", cjk, automata, n))
+                written.append(path)
+                names.append(name)
+                n += 1
+            if names:
+                topics.append((f"topic{t}", names))
+        index = os.path.join(section_dir, "index.md")
+        _write(index, f"# Section {section}\n\n{_toc(topics)}\n\n{_paragraph(rng, cjk)}\n")
+        links = [f"{topic}/" for topic, _ in topics]
+        links += [f"{topic}/{page}" for topic, names in topics for page in names]
+        tocs.append((section_dir, links))
+        written.append(index)
+        section += 1
+    _write(os.path.join(docs_dir, "index.md"), "# Home\n\n" + _paragraph(rng, cjk) + "\n")
+
+    ignore_commits = []
+    if history:
+        ignore_commits = _history(root, rng, written, rounds)
+    _write(os.path.join(root, ".ignored-commits"), "".join(f"{sha}\n" for sha in ignore_commits))
+    _write(os.path.join(root, "mkdocs.yml"), _config())
+    return Corpus(root, docs_dir, tocs, written, ignore_commits)
+
+
+def _history(root: str, rng: random.Random, pages: list, rounds: int) -> list:
+    """
+    Commit the corpus over several rounds of edits and renames, return the
+    sha of the formatting commit that the TOC should ignore.
+    """
+    _git(root, "init", "-q")
+    _git(root, "add", "-A")
+    timestamp = EPOCH
+    _git(root, "commit", "-q", "-m", "initial notes", timestamp=timestamp)
+
+    content = [p for p in pages if not p.endswith("index.md")]
+    for r in range(rounds):
+        timestamp += 86400
+        for path in rng.sample(content, max(1, len(content) // 5)):
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(f"\nEdited in round {r}.\n")
+        # moving a page and back keeps the tree the TOC links to intact, but
+        # leaves renames in the history that the index has to follow
+        for path in rng.sample(content, max(1, len(content) // 20)):
+            moved = path[: -len(".md")] + f"-draft{r}.md"
+            _git(root, "mv", path, moved)
+            _git(root, "commit", "-q", "-m", f"draft {os.path.basename(path)}", timestamp=timestamp)
+            _git(root, "mv", moved, path)
+        _git(root, "add", "-A")
+        _git(root, "commit", "-q", "-m", f"edits round {r}", timestamp=timestamp)
+
+    # touches every page without changing what it says
+    timestamp += 86400
+    for path in content:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("\n")
+    _git(root, "add", "-A")
+    _git(root, "commit", "-q", "-m", "format", timestamp=timestamp)
+    return [_git(root, "rev-parse", "HEAD")]
+
+
+def _config() -> str:
+    hooks = "".join(f"  - {os.path.join(ROOT, 'hooks', hook)}.py\n" for hook in HOOKS)
+    return (
+        "site_name: corpus\n"
+        "theme:\n"
+        "  name: material\n"
+        "  features: [navigation.tabs, navigation.indexes]\n"
+        f"hooks:\n{hooks}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("out")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--cjk", type=float, default=0.5)
+    parser.add_argument("--automata", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-history", dest="history", action="store_false")
+    args = parser.parse_args()
+    if os.path.exists(args.out) and os.listdir(args.out):
+        sys.exit(f"{args.out} is not empty")
+    corpus = generate(args.out, args.pages, args.cjk, args.automata, args.seed, args.history)
+    print(f"wrote {len(corpus.pages)} pages in {len(corpus.tocs)} sections to {corpus.docs_dir}")
+
+
+if __name__ == "__main__":
+    main()
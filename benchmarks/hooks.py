@@ -0,0 +1,286 @@
+"""
+Benchmark the hot functions of the hooks on synthetic corpora of several sizes.
+
+Every size gets its own corpus from corpus.py, git history included, and
+every benchmark reports the median of its repeats in milliseconds. TeX runs
+go to the fake xelatex and dvisvgm in benchmarks/fake_tex, so the suite needs
+neither a TeX installation nor the network.
+
+    python benchmarks/hooks.py [--sizes 50,200,800] [--repeat 5]
+                               [--only NAME] [--json OUT] [--compare OLD]
+
+--json saves the results, --compare prints them next to an earlier run.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+from types import SimpleNamespace
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT = os.path.dirname(BENCHMARKS_DIR)
+FAKE_TEX = os.path.join(BENCHMARKS_DIR, "fake_tex")
+
+# every hook enabled, nothing running behind the back of the clock
+os.environ.update(THEME="1", LINKBACKWARD="1", TOC="1", TIKZ="1", PREFETCH="0", PROFILE="0")
+os.environ["PATH"] = FAKE_TEX + os.pathsep + os.environ.get("PATH", "")
+sys.path.insert(0, os.path.join(ROOT, "hooks"))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import linkbackward  # noqa: E402
+import theme_override  # noqa: E402
+from corpus import generate  # noqa: E402
+from utils.automata_svg import UnsupportedAutomaton, render_automaton  # noqa: E402
+from utils.markdown_utils import (  # noqa: E402
+    iter_indented_blocks,
+    replace_indented_block_start_with_options,
+)
+from utils.tikz_renderer import TikZAutomataRenderer, render_batch  # noqa: E402
+from utils.toc import (  # noqa: E402
+    _words_count,
+    get_statistics,
+    get_update_time,
+    reset_timestamp_index,
+    reset_tree_index,
+)
+
+AUTOMATA = "\\automata"
+# labels of the nav items below a section, the first ones theme_override lifts
+TOPIC_LABELS = ["misc", "crypto", "notes", "web", "labs"]
+
+
+def _read(corpus) -> list[str]:
+    texts = []
+    for path in corpus.pages:
+        with open(path, "r", encoding="utf-8") as f:
+            texts.append(f.read())
+    return texts
+
+
+def bench_words_count(corpus, workdir):
+    texts = _read(corpus)
+    return None, lambda: [_words_count(text) for text in texts]
+
+
+def bench_get_statistics(corpus, workdir):
+    def run():
+        reset_tree_index(None)
+        for base, links in corpus.tocs:
+            for link in links:
+                get_statistics(link, base)
+
+    return None, run
+
+
+def bench_get_update_time(corpus, workdir):
+    def run():
+        reset_timestamp_index(None)
+        reset_tree_index(None)
+        for base, links in corpus.tocs:
+            for link in links:
+                get_update_time(link, base, corpus.ignore_commits)
+
+    return None, run
+
+
+def bench_automata_blocks(corpus, workdir):
+    texts = _read(corpus)
+    return None, lambda: [
+        replace_indented_block_start_with_options(AUTOMATA, lambda block: "", text)
+        for text in texts
+    ]
+
+
+def _nav_html(corpus) -> str:
+    """
+    A page like Material renders it, with the whole corpus in a lifted nav.
+    """
+    parts = [
+        "<!doctype html><html><head><title>page</title></head><body>",
+        '<nav class="md-nav md-nav--primary md-nav--lifted" aria-label="Navigation" data-md-level="0">',
+        '<ul class="md-nav__list" data-md-scrollfix>',
+    ]
+    for s, (base, links) in enumerate(corpus.tocs):
+        active = " md-nav__item--active" if s == 0 else ""
+        parts.append(
+            f'<li class="md-nav__item{active} md-nav__item--nested">'
+            f'<input class="md-nav__toggle md-toggle" type="checkbox" id="__nav_{s}">'
+            f'<label class="md-nav__link" for="__nav_{s}">Section {s}</label>'
+            f'<nav class="md-nav" data-md-level="1"><label class="md-nav__title">Section {s}</label>'
+            '<ul class="md-nav__list">'
+        )
+        topics = [link for link in links if link.endswith("/")]
+        for t, topic in enumerate(topics):
+            label = TOPIC_LABELS[t % len(TOPIC_LABELS)]
+            parts.append(
+                '<li class="md-nav__item md-nav__item--nested">'
+                f'<input class="md-nav__toggle md-toggle" type="checkbox" id="__nav_{s}_{t}">'
+                f'<label class="md-nav__link" for="__nav_{s}_{t}">{label}</label>'
+                '<nav class="md-nav" data-md-level="2"><ul class="md-nav__list">'
+            )
+            for link in links:
+                if link.startswith(topic) and link != topic:
+                    parts.append(
+                        f'<li class="md-nav__item"><a href="/{link}/" class="md-nav__link">{link}</a></li>'
+                    )
+            parts.append("</ul></nav></li>")
+        parts.append("</ul></nav></li>")
+    parts.append("</ul></nav><article><p>" + "text " * 2000 + "</p></article></body></html>")
+    return "".join(parts)
+
+
+def bench_theme_override(corpus, workdir):
+    output = _nav_html(corpus)
+    # one page per page of the corpus, grouped by section like Material does
+    pages = [
+        SimpleNamespace(ancestors=[SimpleNamespace(title=f"Section {s}")])
+        for s, (_, links) in enumerate(corpus.tocs)
+        for _ in links
+    ]
+
+    def run():
+        theme_override._patches.clear()
+        for page in pages:
+            theme_override.on_post_page(output, page=page, config=None)
+
+    return None, run
+
+
+def _site(corpus, workdir) -> tuple[str, list]:
+    """
+    A site_dir holding the redirection template and one old link per page
+    of the corpus, all pointing at pages that exist.
+    """
+    site_dir = os.path.join(workdir, "site")
+    shutil.rmtree(site_dir, ignore_errors=True)
+    os.makedirs(site_dir)
+    shutil.copyfile(
+        os.path.join(ROOT, "overrides", "redirection.html"),
+        os.path.join(site_dir, "redirection.html"),
+    )
+    redirs = []
+    for path in corpus.pages:
+        page = os.path.relpath(os.path.splitext(path)[0], corpus.docs_dir).replace(os.sep, "/")
+        dst = f"/{page}/index.html"
+        os.makedirs(os.path.join(site_dir, page), exist_ok=True)
+        with open(os.path.join(site_dir, dst[1:]), "w", encoding="utf-8") as f:
+            f.write("page")
+        redirs.append((f"/old/{page}/index.html", dst))
+    return site_dir, redirs
+
+
+def _linkbackward(corpus, workdir, fresh: bool):
+    site_dir, redirs = _site(corpus, workdir)
+    config = {"site_dir": site_dir, "site_url": "https://example.com/"}
+
+    def prepare():
+        linkbackward.redirs = redirs
+        if fresh:
+            shutil.rmtree(os.path.join(site_dir, "old"), ignore_errors=True)
+
+    def run():
+        linkbackward.on_post_build(config)
+
+    if not fresh:
+        prepare()
+        run()
+    return prepare, run
+
+
+def bench_linkbackward_fresh(corpus, workdir):
+    return _linkbackward(corpus, workdir, fresh=True)
+
+
+def bench_linkbackward_unchanged(corpus, workdir):
+    return _linkbackward(corpus, workdir, fresh=False)
+
+
+def bench_tikz_batches(corpus, workdir):
+    """
+    Everything around the TeX runs of the pictures that need TeX, with TeX
+    itself faked.
+    """
+    renderers = []
+    for text in _read(corpus):
+        for block in iter_indented_blocks(AUTOMATA, text):
+            try:
+                render_automaton(block.options, block.contents)
+            except UnsupportedAutomaton:
+                renderers.append(
+                    TikZAutomataRenderer(block.options, block.contents, os.path.join(workdir, "tikz"))
+                )
+    batches = [renderers[i : i + 16] for i in range(0, len(renderers), 16)]
+    return None, lambda: [render_batch(batch) for batch in batches]
+
+
+BENCHMARKS = {
+    "_words_count": bench_words_count,
+    "get_statistics": bench_get_statistics,
+    "get_update_time": bench_get_update_time,
+    "replace_indented_block_start_with_options": bench_automata_blocks,
+    "theme_override.on_post_page": bench_theme_override,
+    "linkbackward.on_post_build (fresh)": bench_linkbackward_fresh,
+    "linkbackward.on_post_build (unchanged)": bench_linkbackward_unchanged,
+    "tikz render_batch (fake TeX)": bench_tikz_batches,
+}
+
+
+def measure(prepare, run, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        if prepare is not None:
+            prepare()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="50,200,800")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", action="append", default=[])
+    parser.add_argument("--json")
+    parser.add_argument("--compare")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    names = [name for name in BENCHMARKS if not args.only or any(o in name for o in args.only)]
+    previous = {}
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)["results"]
+
+    results = {name: {} for name in names}
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix="hooks-bench-") as workdir:
+            corpus = generate(os.path.join(workdir, "corpus"), pages=size)
+            for name in names:
+                prepare, run = BENCHMARKS[name](corpus, workdir)
+                results[name][str(size)] = measure(prepare, run, args.repeat)
+
+    width = max(len(name) for name in names)
+    column = 20 if previous else 12
+    print(f"{'pages':<{width}}" + "".join(f"{size:>{column}}" for size in sizes))
+    for name in names:
+        row = f"{name:<{width}}"
+        for size in sizes:
+            ms = results[name][str(size)]
+            old = previous.get(name, {}).get(str(size))
+            cell = f"{ms:.1f}ms" if not old else f"{ms:.1f}ms {ms / old:.2f}x"
+            row += f"{cell:>{column}}"
+        print(row)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"sizes": sizes, "repeat": args.repeat, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
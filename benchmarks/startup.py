@@ -0,0 +1,73 @@
+"""
+Time how long importing each hook takes in a fresh interpreter.
+
+MkDocs itself and the theme are loaded before the clock starts, so the numbers
+are what the hooks add to the startup of `mkdocs build` and `mkdocs serve`.
+Every hook is timed with the flags of a default local build, of CI and of a
+FULL build.
+
+    python benchmarks/startup.py [--repeat N]
+"""
+
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+HOOKS_DIR = os.path.join(ROOT, "hooks")
+HOOKS = ["theme_override", "linkbackward", "toc", "tikzautomata", "buildprofile"]
+CONFIGS = {
+    "default": {},
+    "ci": {"THEME": "0", "LINKBACKWARD": "0", "TIKZ": "0"},
+    "full": {"FULL": "true"},
+}
+
+PROGRAM = """
+import sys, time
+import mkdocs.config.defaults, mkdocs.structure.files, mkdocs.structure.nav
+import mkdocs.structure.pages, mkdocs.utils
+sys.path.insert(0, {hooks_dir!r})
+start = time.perf_counter()
+import {hook}
+print(time.perf_counter() - start)
+"""
+
+
+def time_import(hook: str, env: dict) -> float:
+    flags = {
+        key: value
+        for key, value in os.environ.items()
+        if key not in ("FULL", "THEME", "LINKBACKWARD", "TIKZ", "TOC")
+    }
+    flags.update(env)
+    output = subprocess.run(
+        [sys.executable, "-c", PROGRAM.format(hooks_dir=HOOKS_DIR, hook=hook)],
+        env=flags,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return float(output.split()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'hook':<16}" + "".join(f"{name:>12}" for name in CONFIGS))
+    totals = dict.fromkeys(CONFIGS, 0.0)
+    for hook in HOOKS:
+        row = f"{hook:<16}"
+        for name, env in CONFIGS.items():
+            median = statistics.median(time_import(hook, env) for _ in range(args.repeat))
+            totals[name] += median
+            row += f"{median * 1000:>10.1f}ms"
+        print(row)
+    print(f"{'total':<16}" + "".join(f"{totals[name] * 1000:>10.1f}ms" for name in CONFIGS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import os
+import logging
+
+from mkdocs.config.defaults import MkDocsConfig
+
+from utils.profiler import PROFILE, PROFILE_DIR, get_profiler
+
+enabled = PROFILE
+logger = logging.getLogger("mkdocs.hooks.buildprofile")
+
+if enabled:
+    logger.info("hook - buildprofile is loaded and enabled")
+else:
+    logger.info("hook - buildprofile is disabled")
+
+# PROFILE_DIR, or .cache/profile next to the mkdocs.yml being built
+_profile_dir = PROFILE_DIR
+# start of the build in progress, on the clock of the profiler
+_build_start = None
+
+
+def on_config(config: MkDocsConfig) -> None:
+    global _profile_dir
+    if enabled and not os.getenv("PROFILE_DIR"):
+        from utils.page_cache import cache_root
+
+        _profile_dir = os.path.join(cache_root(config.config_file_path), "profile")
+
+
+def on_pre_build(config: MkDocsConfig) -> None:
+    """
+    Start a fresh profile, so that every rebuild of `mkdocs serve` gets its own.
+    """
+    global _build_start
+    if not enabled:
+        return
+    profiler = get_profiler()
+    profiler.reset()
+    _build_start = profiler.now()
+
+
+def on_post_build(config: MkDocsConfig) -> None:
+    """
+    Registered last, so that it runs after the on_post_build of every other hook.
+    """
+    if not enabled or _build_start is None:
+        return
+    profiler = get_profiler()
+    profiler.add("build", "build", _build_start, profiler.now())
+    trace_path, summary_path = profiler.write(_profile_dir)
+    logger.info("slowest pages:\n" + profiler.summary())
+    logger.info(
+        f"wrote the build profile to {os.path.relpath(trace_path)} and {os.path.relpath(summary_path)}"
+    )
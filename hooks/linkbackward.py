@@ -1,8 +1,17 @@
 import os
 import re
+import json
 import logging
+from hashlib import sha256
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple
+from urllib.parse import urlsplit
+
+from mkdocs.structure.files import Files
+
+from utils.profiler import profiled
 
 enabled = os.getenv("LINKBACKWARD", "0") == "1" or os.getenv("FULL", "0") == "true"
 logger = logging.getLogger("mkdocs.hooks.linkbackward")
@@ -12,6 +21,17 @@ if enabled:
 else:
     logger.info("hook - linkbackward is disabled")
 
+# "stubs" writes an index.html for every old link, "map" one redirect table
+# that the 404 page resolves on the client
+MODE = os.getenv("LINKBACKWARD_MODE", "stubs")
+# also write the table as a _redirects file, for hosts that redirect themselves
+REDIRECTS_FILE = os.getenv("LINKBACKWARD_REDIRECTS", "0") == "1"
+MAP_DIR = "assets/javascripts"
+
+if MODE not in ("stubs", "map"):
+    logger.warning(f"Unknown LINKBACKWARD_MODE `{MODE}`, writing stubs")
+    MODE = "stubs"
+
 WAIT_TIME = 0
 REDIRS = [
     ("/ctf/steg/", "/ctf/misc/steg/"),
@@ -70,51 +90,205 @@ for src, dst in REDIRS:
     logger.debug(f"Redirect: `{src}` -> `{dst}`")
 
 
-def on_post_build(config: Dict[str, Any], **kwargs) -> None:
-    if not enabled:
-        return
-    site_dir = config["site_dir"]
-    template_file_path = os.path.join(site_dir, "redirection.html")
-    with open(template_file_path, "r", encoding="utf-8") as f:
-        template = f.read()
+# where the template is filled in, each of them replaced in a single pass
+_PLACEHOLDERS = {
+    "./": "prefix",
+    "//old//": "old",
+    "//new//": "new",
+    "//wait_time//": "wait_time",
+    "<script>": "script",
+}
+_PLACEHOLDER = re.compile("(" + "|".join(re.escape(key) for key in _PLACEHOLDERS) + ")")
+
+# the files MkDocs writes itself, a redirection never replaces one of them
+_outputs = set()
+
+
+@lru_cache(maxsize=1)
+def _compile(template: str) -> tuple:
+    """
+    The template split into literal text and the names of its placeholders,
+    alternating and starting with text.
+    """
+    parts = _PLACEHOLDER.split(template)
+    return tuple(_PLACEHOLDERS[part] if i % 2 else part for i, part in enumerate(parts))
+
+
+def _fill(segments: tuple, values: Dict[str, str]) -> str:
+    return "".join(
+        values[segment] if i % 2 else segment for i, segment in enumerate(segments)
+    )
+
+
+def _stub(segments: tuple, src: str, dst: str) -> bytes:
+    old = src.replace("index.html", "")
+    new = dst.replace("index.html", "")
+    values = {
+        "prefix": "../" * src.count("/"),
+        "old": old,
+        "new": new,
+        "wait_time": str(WAIT_TIME),
+        "script": f"<script>window.location='{new}';" if WAIT_TIME == 0 else "<script>",
+    }
+    return _fill(segments, values).encode("utf-8")
+
+
+def _listing(site_dir: str) -> tuple:
+    """
+    The files and directories below site_dir, relative to it and with forward
+    slashes like the redirections.
+    """
+    files, directories = set(), set()
+    for root, dirnames, filenames in os.walk(site_dir):
+        relative = os.path.relpath(root, site_dir).replace(os.sep, "/")
+        relative = "" if relative == "." else relative + "/"
+        directories.update(relative + name for name in dirnames)
+        files.update(relative + name for name in filenames)
+    return files, directories
+
+
+def _write(path: str, content: bytes, exists: bool) -> bool:
+    """
+    Write content to path unless it already holds exactly that, so that
+    unchanged stubs keep their modification times.
+    """
+    if exists:
+        try:
+            with open(path, "rb") as f:
+                if f.read() == content:
+                    return False
+        except OSError:
+            pass
+    with open(path, "wb") as f:
+        f.write(content)
+    return True
+
+
+def on_files(files: Files, **kwargs) -> Files:
+    if enabled:
+        _outputs.clear()
+        _outputs.update(file.dest_uri for file in files)
+    return files
+
+
+def _redirections(existing: set) -> List[Tuple[str, str]]:
+    """
+    The redirections whose source is free and whose dest exists.
+    """
+    valid, created = [], set()
     for src, dst in redirs:
-        if os.path.exists(os.path.join(site_dir, src[1:])):
+        # a stub left by an earlier --dirty build is rewritten, a page is not
+        if src[1:] in _outputs or src[1:] in created:
             logger.warning(
                 f"Skip creating redirection file `{src}` because it already exists"
             )
             continue
-        if not os.path.exists(os.path.join(site_dir, dst[1:])):
+        if dst[1:] not in existing and dst[1:] not in created:
             logger.warning(
                 f"Skip creating redirection file `{src}` because the dest `{dst}` does not exist"
             )
             continue
         logger.debug(f"Creating redirection file `{src}` -> `{dst}`")
-        src_file = re.sub(
-            r"\./",
-            "../" * src.count("/"),
-            template,
-        )
-        src_file = re.sub(
-            r"//old//",
-            src.replace("index.html", ""),
-            src_file,
-        )
-        src_file = re.sub(
-            r"//new//",
-            dst.replace("index.html", ""),
-            src_file,
-        )
-        src_file = re.sub(
-            r"//wait_time//",
-            str(WAIT_TIME),
-            src_file,
-        )
-        if WAIT_TIME == 0:
-            src_file = re.sub(
-                "<script>",
-                f"<script>window.location='{dst.replace('index.html', '')}';",
-                src_file,
+        valid.append((src, dst))
+        created.add(src[1:])
+    return valid
+
+
+def _write_stubs(site_dir: str, redirections: list, existing: set, directories: set) -> None:
+    template_file_path = os.path.join(site_dir, "redirection.html")
+    with open(template_file_path, "r", encoding="utf-8") as f:
+        segments = _compile(f.read())
+    stubs = [(src[1:], _stub(segments, src, dst)) for src, dst in redirections]
+
+    missing = {os.path.dirname(path) for path, _ in stubs} - directories - {""}
+    # the deepest ones create their parents along the way
+    for directory in sorted(missing, reverse=True):
+        os.makedirs(os.path.join(site_dir, directory), exist_ok=True)
+
+    with ThreadPoolExecutor() as pool:
+        written = sum(
+            pool.map(
+                lambda stub: _write(
+                    os.path.join(site_dir, stub[0]), stub[1], stub[0] in existing
+                ),
+                stubs,
             )
-        os.makedirs(os.path.dirname(os.path.join(site_dir, src[1:])), exist_ok=True)
-        with open(os.path.join(site_dir, src[1:]), "w", encoding="utf-8") as f:
-            f.write(src_file)
+        )
+    logger.debug(
+        f"Wrote {written} redirection files, {len(stubs) - written} were unchanged"
+    )
+
+
+# looks the requested path up with and without index.html and the trailing
+# slash, and keeps the query and fragment
+_RESOLVER = """(function () {
+  var base = %(base)s, table = %(table)s;
+  var path = decodeURIComponent(location.pathname);
+  if (path.indexOf(base) !== 0) return;
+  path = "/" + path.slice(base.length);
+  var dir = path.replace(/index\\.html?$/, "");
+  var target = table[path] || table[dir] || table[dir.replace(/\\/?$/, "/")];
+  if (target) location.replace(base + target.slice(1) + location.search + location.hash);
+})();
+"""
+_HEAD = re.compile(r"<head[^>]*>", re.I)
+
+
+def _old_link(path: str) -> str:
+    return path[: -len("index.html")] if path.endswith("/index.html") else path
+
+
+def _write_map(site_dir: str, base: str, table: dict, existing: set) -> None:
+    script = _RESOLVER % {
+        "base": json.dumps(base),
+        "table": json.dumps(table, ensure_ascii=False, sort_keys=True, separators=(",", ":")),
+    }
+    content = script.encode("utf-8")
+    name = f"{MAP_DIR}/redirects.{sha256(content).hexdigest()[:8]}.js"
+    os.makedirs(os.path.join(site_dir, MAP_DIR), exist_ok=True)
+    _write(os.path.join(site_dir, name), content, name in existing)
+    # tables of earlier --dirty builds
+    for path in existing:
+        if re.fullmatch(rf"{MAP_DIR}/redirects\.[0-9a-f]{{8}}\.js", path) and path != name:
+            os.remove(os.path.join(site_dir, path))
+
+    # the theme renders 404.html itself, so unknown links still get a real 404
+    not_found = os.path.join(site_dir, "404.html")
+    if "404.html" not in existing:
+        logger.warning("Skip the redirection map because there is no 404.html to resolve it")
+    else:
+        with open(not_found, "r", encoding="utf-8") as f:
+            html = f.read()
+        tag = f'<script src="{base}{name}"></script>'
+        if tag not in html:
+            head = _HEAD.search(html)
+            at = head.end() if head else 0
+            _write(not_found, (html[:at] + tag + html[at:]).encode("utf-8"), True)
+    logger.debug(f"Wrote {len(table)} redirections to `{name}`")
+
+
+def _write_redirects_file(site_dir: str, base: str, table: dict, existing: set) -> None:
+    lines = [f"{base}{old[1:]} {base}{new[1:]} 301\n" for old, new in table.items()]
+    _write(
+        os.path.join(site_dir, "_redirects"),
+        "".join(lines).encode("utf-8"),
+        "_redirects" in existing,
+    )
+
+
+@profiled("linkbackward.on_post_build")
+def on_post_build(config: Dict[str, Any], **kwargs) -> None:
+    if not enabled:
+        return
+    site_dir = config["site_dir"]
+    existing, directories = _listing(site_dir)
+    redirections = _redirections(existing)
+    # the path the site is served below, which the redirections are relative to
+    base = urlsplit(config.get("site_url") or "/").path.rstrip("/") + "/"
+    table = {_old_link(src): _old_link(dst) for src, dst in redirections}
+    if MODE == "map":
+        _write_map(site_dir, base, table, existing)
+    else:
+        _write_stubs(site_dir, redirections, existing, directories)
+    if REDIRECTS_FILE:
+        _write_redirects_file(site_dir, base, table, existing)
@@ -1,13 +1,19 @@
 import os
+import re
 import logging
-
-from bs4 import BeautifulSoup
+from bisect import bisect_right
+from hashlib import sha256
+from html import unescape
 
 from mkdocs.config.defaults import MkDocsConfig
-from mkdocs.structure.nav import Page
+from mkdocs.structure.files import Files
+from mkdocs.structure.nav import Navigation, Page
 
 from typing import Optional
 
+from utils.html_utils import class_attribute, iter_tags, parse_tag
+from utils.profiler import profiled
+
 enabled = os.getenv("THEME", "0") == "1" or os.getenv("FULL", "0") == "true"
 logger = logging.getLogger("mkdocs.hooks.theme_override")
 
@@ -16,24 +22,204 @@ if enabled:
 else:
     logger.info("hook - theme_override is disabled")
 
+SECTIONS = {"misc", "blockchain", "crypto", "web", "reverse", "pwn"}
+SECTION_CLASS = "md-nav__item--section"
+# classes along `.md-nav--lifted>.md-nav__list>.md-nav__item>.md-nav>.md-nav__list>.md-nav__item`
+CHAIN = ["md-nav--lifted", "md-nav__list", "md-nav__item", "md-nav", "md-nav__list", "md-nav__item"]
+
+_NAV_TAG = re.compile(r"<(/?)nav\b")
+_ITEM = re.compile(r"<li class=\"md-nav__item\b")
+_LABEL = re.compile(r"<label\b[^>]*>(.*?)</label>", re.S)
+_INNER_TAG = re.compile(r"<[^>]*>")
+
+# hash of the structure of the nav the patches below were computed for
+_signature = None
+# (titles of the page ancestors, items in the nav) -> [(item ordinal, label text)]
+# of the items that become sections; pages at the same place in the same nav
+# share the rendered nav up to the active markers
+_patches = {}
+
+
+def _nav_signature(items) -> str:
+    def _walk(items):
+        return [
+            (item.title, getattr(item, "url", None), _walk(item.children or []))
+            for item in items
+        ]
+
+    return sha256(repr(_walk(items)).encode()).hexdigest()
+
+
+def on_nav(nav: Navigation, *, config: MkDocsConfig, files: Files) -> Optional[Navigation]:
+    global _signature
+    if not enabled:
+        return nav
+    signature = _nav_signature(nav.items)
+    if signature != _signature:
+        _signature = signature
+        _patches.clear()
+    return nav
+
+
+def _lifted_navs(output: str):
+    """
+    The start tags of the elements with class md-nav--lifted.
+    """
+    pos = 0
+    while True:
+        found = output.find("md-nav--lifted", pos)
+        if found < 0:
+            return
+        pos = found + 1
+        tag = parse_tag(output, output.rfind("<", 0, found))
+        if tag is None or tag.closing or tag.end <= found:
+            continue
+        attribute = class_attribute(output, tag)
+        if attribute and "md-nav--lifted" in attribute[2].split():
+            yield tag
+            pos = tag.end
+
+
+def _section_patches(output: str, nav) -> tuple[list, int, list]:
+    """
+    The class attributes to extend below one lifted nav, as (start, end,
+    replacement), where the nav ends, and the start tags of all items at the
+    end of CHAIN.
 
+    Only the nav is tokenized: a stack of the open elements and their classes
+    tells which items sit at the end of CHAIN, and the text of the first
+    label inside such an item decides whether it becomes a section.
+    """
+    patches = []
+    chain = []
+    stack = [(nav.name, class_attribute(output, nav)[2].split(), nav)]
+    # items of CHAIN still waiting for their first label, by stack depth
+    items = {}
+    # (depth of the label, items it decides, text so far)
+    label = None
+    last = nav.end
+    for tag in iter_tags(output, nav.end):
+        if label is not None:
+            label[2].append(output[last : tag.start])
+        last = tag.end
+        if not tag.name:
+            continue
+        if tag.closing:
+            depths = [i for i, (name, _, _) in enumerate(stack) if name == tag.name]
+            if not depths:
+                continue
+            del stack[depths[-1] :]
+            if label is not None and len(stack) < label[0]:
+                if unescape("".join(label[2])).strip() in SECTIONS:
+                    for item in label[1]:
+                        start, end, value = class_attribute(output, item)
+                        patches.append((start, end, f'"{value} {SECTION_CLASS}"'))
+                label = None
+            for depth in [depth for depth in items if depth > len(stack)]:
+                del items[depth]
+            if not stack:
+                return patches, tag.end, chain
+            continue
+        if tag.self_closing:
+            continue
+        attribute = class_attribute(output, tag)
+        stack.append((tag.name, attribute[2].split() if attribute else [], tag))
+        if len(stack) >= len(CHAIN) and all(
+            cls in classes for cls, (_, classes, _) in zip(CHAIN, stack[-len(CHAIN) :])
+        ):
+            items[len(stack)] = tag
+            chain.append(tag)
+        if tag.name == "label" and label is None and items:
+            label = (len(stack), list(items.values()), [])
+            items.clear()
+    return patches, len(output), chain
+
+
+def _nav_end(output: str, nav) -> int:
+    """
+    Where the nav element starting with the tag nav ends.
+    """
+    depth = 1
+    for matched in _NAV_TAG.finditer(output, nav.end):
+        depth += -1 if matched.group(1) else 1
+        if depth == 0:
+            return matched.end()
+    return len(output)
+
+
+def _label_text(output: str, pos: int, end: int) -> Optional[str]:
+    matched = _LABEL.search(output, pos, end)
+    if not matched:
+        return None
+    return unescape(_INNER_TAG.sub("", matched.group(1))).strip()
+
+
+def _memoized_patches(output: str, nav, page: Optional[Page]) -> tuple[list, int]:
+    """
+    _section_patches, but applied from the patches of an earlier page at the
+    same place in the nav when all items of CHAIN still line up, which is
+    checked by the text of the label following each of them.
+    """
+    if nav.name != "nav":
+        return _section_patches(output, nav)[:2]
+    end = _nav_end(output, nav)
+    items = [matched.start() for matched in _ITEM.finditer(output, nav.end, end)]
+    ancestors = tuple(item.title for item in page.ancestors) if page else ()
+    key = (ancestors, len(items))
+
+    cached = _patches.get(key)
+    if cached is not None:
+        patches = []
+        for ordinal, text, section in cached:
+            item = parse_tag(output, items[ordinal])
+            if _label_text(output, item.end, end) != text:
+                break
+            if section:
+                start, stop, value = class_attribute(output, item)
+                patches.append((start, stop, f'"{value} {SECTION_CLASS}"'))
+        else:
+            return patches, end
+
+    patches, end, chain = _section_patches(output, nav)
+    sections = {start for start, _, _ in patches}
+    memo = []
+    for tag in chain:
+        ordinal = bisect_right(items, tag.start) - 1
+        if ordinal < 0 or items[ordinal] != tag.start:
+            # an item the scan for `<li class="md-nav__item` misses, no shortcut
+            _patches.pop(key, None)
+            return patches, end
+        memo.append(
+            (
+                ordinal,
+                _label_text(output, tag.end, end),
+                class_attribute(output, tag)[0] in sections,
+            )
+        )
+    _patches[key] = memo
+    return patches, end
+
+
+@profiled("theme_override.on_post_page")
 def on_post_page(output: str, *, page: Page, config: MkDocsConfig) -> Optional[str]:
     if not enabled:
         return output
-    soup = BeautifulSoup(output, "lxml")
-
-    navs = soup.select(
-        ".md-nav--lifted>.md-nav__list>.md-nav__item>.md-nav>.md-nav__list>.md-nav__item"
-    )
-    for nav in navs:
-        if nav.select("label") and nav.select("label")[0].text.strip() in [
-            "misc",
-            "blockchain",
-            "crypto",
-            "web",
-            "reverse",
-            "pwn",
-        ]:
-            nav["class"].append("md-nav__item--section")
-
-    return str(soup)
+
+    patches = []
+    end = 0
+    for nav in _lifted_navs(output):
+        if nav.start < end:
+            continue
+        found, end = _memoized_patches(output, nav, page)
+        patches.extend(found)
+    if not patches:
+        return output
+
+    parts = []
+    last = 0
+    for start, stop, replacement in patches:
+        parts.append(output[last:start])
+        parts.append(replacement)
+        last = stop
+    parts.append(output[last:])
+    return "".join(parts)
@@ -1,17 +1,29 @@
 import os
-import re
 import logging
+import threading
+from hashlib import sha256
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 
 from mkdocs.config.defaults import MkDocsConfig
 from mkdocs.structure.pages import Page
-from mkdocs.structure.files import Files
+from mkdocs.structure.files import File, Files
+from mkdocs.utils import get_relative_url, meta
 
-from utils.tikz_renderer import TikZAutomataRenderer
+from utils.profiler import profiled, span, track
 from utils.markdown_utils import (
-    replace_indented_block_start_with_options,
-    get_indentation_level,
+    IndentedBlock,
+    iter_indented_blocks,
+    marker_spans,
+    register_marker,
 )
 
+if TYPE_CHECKING:
+    # loads watchdog, which `mkdocs build` never needs
+    from mkdocs.livereload import LiveReloadServer
+    from utils.page_cache import PageCache
+    from utils.tikz_renderer import TikZAutomataRenderer
+
 enabled = os.getenv("TIKZ", "1") == "1" or os.getenv("FULL", "0") == "true"
 logger = logging.getLogger("mkdocs.hooks.tikzautomata")
 
@@ -20,57 +32,475 @@ if enabled:
 else:
     logger.info("hook - tikzautomata is disabled")
 
+if enabled:
+    # TeX, the svg caches and the pools are only loaded by builds that draw diagrams
+    from utils.tikz_renderer import (
+        TeXError,
+        TikZAutomataRenderer,
+        ensure_format,
+        format_dir,
+        render_to_cache,
+        tex_version,
+    )
+    from utils.automata_svg import UnsupportedAutomaton, render_automaton
+    from utils.svg_cache import SVGCache
+    from utils.svg_optimizer import optimize_svgs
+    from utils.page_cache import (
+        ENABLED as PAGE_CACHE,
+        PageCache,
+        cache_root,
+        fingerprint,
+        source_fingerprint,
+    )
+    from utils.prefetch import get_prefetcher, shutdown_prefetcher
+
 CACHE = True
+HOOKS_DIR = os.path.dirname(os.path.realpath(__file__))
+# below .cache so that CI saves and restores it together with the other caches,
+# moved next to the mkdocs.yml being built by on_config
+CACHE_DIR = os.path.join(HOOKS_DIR, "..", ".cache", "tikzautomata")
+PAGES_DIR = os.path.join(HOOKS_DIR, "..", ".cache", "pages")
+CACHE_MAX_BYTES = int(os.getenv("TIKZ_CACHE_MAX_MB", "64")) * 1024 * 1024
+AUTOMATA = "\\automata"
+if enabled:
+    register_marker(AUTOMATA)
+WORKERS = int(os.getenv("TIKZ_WORKERS", "0")) or os.cpu_count() or 1
+BATCH_SIZE = int(os.getenv("TIKZ_BATCH", "16"))
+# start every compile from a dumped format of the preamble
+PRECOMPILE = os.getenv("TIKZ_FORMAT", "1") == "1"
+# keep a spare TeX process with the format loaded around, implies PRECOMPILE
+WARM = os.getenv("TIKZ_WARM", "0") == "1"
+# round coordinates and share glyphs between the diagrams of a page
+OPTIMIZE = os.getenv("TIKZ_OPTIMIZE", "1") == "1"
+SVG_DIGITS = int(os.getenv("TIKZ_SVG_DIGITS", "3"))
+# write diagrams as content-hashed files below ASSETS_DIR instead of inlining them
+EXTERNAL = os.getenv("TIKZ_EXTERNAL", "0") == "1"
+ASSETS_DIR = "assets/automata"
+# seconds a single xelatex or dvisvgm run may take before it is killed
+TIMEOUT = float(os.getenv("TIKZ_TIMEOUT", "120"))
+# during `mkdocs serve`, show a placeholder and render uncached diagrams in the background
+BACKGROUND = os.getenv("TIKZ_BACKGROUND", "1") == "1"
+# touched whenever a background render finishes, watched by the livereload server
+SENTINEL = os.path.join(CACHE_DIR, "rendered")
+# "tex" always runs TeX, "auto" draws the common automata subset in python and only
+# runs TeX for the rest; its fonts and geometry differ from the TeX output
+BACKEND = os.getenv("TIKZ_BACKEND", "tex")
+
+PENDING_HTML = '<div class="automata-pending" style="text-align: center; opacity: 0.6;">rendering diagram…</div>'
+FAILED_HTML = '<div class="automata-failed" style="text-align: center; color: var(--md-typeset-del-color, red);">diagram failed to render, see the log</div>'
+
+# svgs to write into site_dir by on_post_build, by file name
+_assets = {}
+
+_serving = False
+_executor = None
+_lock = threading.Lock()
+# cache key -> (future, renderer) of the background renders in flight
+_inflight = {}
+# page src path -> cache keys its last build asked for
+_wanted = {}
+# cache keys whose background render failed, not retried until they change
+_failed = set()
+
+
+def _renderer(options: str, contents: str) -> "TikZAutomataRenderer":
+    return TikZAutomataRenderer(
+        options, contents, CACHE_DIR, PRECOMPILE or WARM, WARM, TIMEOUT
+    )
+
+
+def _native(block: IndentedBlock):
+    """
+    The svg of block drawn without TeX, or None if it needs TeX.
+    """
+    if BACKEND != "auto":
+        return None
+    try:
+        return render_automaton(block.options, block.contents)
+    except UnsupportedAutomaton as e:
+        logger.debug(f"falling back to TeX: {e}")
+        return None
+
+
+def _background() -> bool:
+    return _serving and BACKGROUND and CACHE
+
+
+def _render_in_background(renderer: "TikZAutomataRenderer") -> None:
+    key = renderer.filename
+    try:
+        renderer.write_to_svg(True)
+    except Exception as e:
+        # anything else, like a missing dvisvgm or a full disk, would leave the
+        # placeholder up for good; the rebuild shows the failure instead
+        if not renderer.cancel.is_set():
+            logger.error(
+                f"background render of {key[:12]} failed: {e}",
+                exc_info=not isinstance(e, TeXError),
+            )
+            with _lock:
+                _failed.add(key)
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+
+    if renderer.cancel.is_set():
+        return
+    # wake up the livereload server, the rebuild picks the svg from the cache
+    try:
+        with open(SENTINEL, "w", encoding="utf-8") as f:
+            f.write(key)
+    except OSError:
+        logger.warning("unable to touch the render sentinel, reload the page manually")
+
+
+def _schedule(renderer: "TikZAutomataRenderer") -> None:
+    global _executor
+    key = renderer.filename
+    with _lock:
+        if key in _inflight:
+            return
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=WORKERS, thread_name_prefix="tikzautomata"
+            )
+        _inflight[key] = (_executor.submit(_render_in_background, renderer), renderer)
+
+
+def _cancel_unwanted() -> None:
+    """
+    Cancel the renders of diagrams that no page asks for anymore, e.g. after
+    an edit replaced them.
+    """
+    wanted = set().union(*_wanted.values())
+    with _lock:
+        for key, (future, renderer) in list(_inflight.items()):
+            if key not in wanted:
+                logger.debug(f"cancelling the render of {key[:12]}")
+                future.cancel()
+                renderer.cancel.set()
+                del _inflight[key]
+
+
+def on_startup(*, command: str, dirty: bool) -> None:
+    global _serving
+    _serving = command == "serve"
+
+
+def on_config(config: MkDocsConfig) -> None:
+    global CACHE_DIR, PAGES_DIR, SENTINEL
+    if not enabled:
+        return
+    cache = cache_root(config.config_file_path)
+    CACHE_DIR = os.path.join(cache, "tikzautomata")
+    PAGES_DIR = os.path.join(cache, "pages")
+    SENTINEL = os.path.join(CACHE_DIR, "rendered")
+
 
+def on_serve(
+    server: "LiveReloadServer", *, config: MkDocsConfig, builder, **kwargs
+) -> "LiveReloadServer":
+    if enabled and _background():
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        if not os.path.exists(SENTINEL):
+            open(SENTINEL, "w", encoding="utf-8").close()
+        server.watch(SENTINEL)
+    return server
 
+
+def on_shutdown() -> None:
+    global _executor
+    if not enabled:
+        return
+    with _lock:
+        for future, renderer in _inflight.values():
+            future.cancel()
+            renderer.cancel.set()
+        _inflight.clear()
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    shutdown_prefetcher()
+
+
+# cache keys of every automata in the docs tree, collected by on_files
+_live = None
+# cache key -> future of the prefetched batch that renders it
+_prerendered = {}
+_page_cache = None
+
+
+def _pages() -> "PageCache":
+    global _page_cache
+    if _page_cache is None:
+        _page_cache = PageCache("tikzautomata", PAGES_DIR)
+    return _page_cache
+
+
+def _fingerprint(file: File) -> str:
+    """
+    Everything the diagrams of a page depend on besides its markdown.
+    """
+    return fingerprint(
+        source_fingerprint(
+            *(
+                os.path.join(HOOKS_DIR, path)
+                for path in (
+                    "tikzautomata.py",
+                    "utils/automata_svg.py",
+                    "utils/markdown_utils.py",
+                    "utils/svg_optimizer.py",
+                    "utils/tikz_renderer.py",
+                )
+            )
+        ),
+        tex_version("xelatex"),
+        tex_version("dvisvgm"),
+        BACKEND,
+        OPTIMIZE,
+        SVG_DIGITS,
+        # external diagrams are linked relative to the page, whose url is
+        # empty for the homepage
+        file.url if EXTERNAL and file.url not in (".", "./") else "",
+    )
+
+
+@profiled("tikzautomata.on_files")
+def on_files(files: Files, *, config: MkDocsConfig) -> Files:
+    """
+    Start rendering every uncached automata of the docs tree in the prefetch
+    processes, so that on_page_markdown mostly reads finished svgs from the
+    cache.
+    """
+    if not enabled or not CACHE:
+        return files
+
+    global _live
+    _live = set()
+    for future in _prerendered.values():
+        future.cancel()
+    _prerendered.clear()
+    pending = {}
+    for file in files.documentation_pages():
+        try:
+            with open(file.abs_src_path, "r", encoding="utf-8") as f:
+                markdown = f.read()
+        except OSError:
+            continue
+        if PAGE_CACHE:
+            # what on_page_markdown gets, unless an earlier hook changes it
+            markdown, _ = meta.get_data(markdown)
+            cached = _pages().peek(markdown, _fingerprint(file))
+            if cached is not None:
+                # the page is taken from the cache, its svgs only need to stay
+                _live.update(cached["keys"])
+                continue
+        for block in iter_indented_blocks(AUTOMATA, markdown):
+            if _native(block) is not None:
+                continue
+            renderer = _renderer(block.options, block.contents)
+            _live.add(renderer.filename)
+            if renderer.filename not in pending and not renderer.is_cached():
+                pending[renderer.filename] = (block.options, block.contents)
+
+    prefetcher = get_prefetcher()
+    if not pending or _background() or prefetcher is None:
+        # while serving, on_page_markdown renders them in the background instead
+        return files
+
+    # share the pictures out evenly, but never beyond BATCH_SIZE per TeX run
+    keys = list(pending)
+    workers = min(WORKERS, prefetcher.workers, len(keys))
+    size = max(1, min(BATCH_SIZE, -(-len(keys) // workers)))
+    batches = [keys[i : i + size] for i in range(0, len(keys), size)]
+
+    logger.info(f"pre-rendering {len(keys)} automata in {len(batches)} batches")
+    try:
+        if PRECOMPILE or WARM:
+            # dump the format once here rather than racing for it in every worker
+            ensure_format(TikZAutomataRenderer.PREAMBLE, format_dir(CACHE_DIR), timeout=TIMEOUT)
+        for batch in batches:
+            future = prefetcher.process(
+                render_to_cache,
+                [pending[key] for key in batch],
+                CACHE_DIR,
+                PRECOMPILE or WARM,
+                WARM,
+                TIMEOUT,
+            )
+            track(future, "tikz pre-render batch", pictures=len(batch))
+            for key in batch:
+                _prerendered[key] = future
+    except Exception as e:
+        # only a speed-up, on_page_markdown renders whatever was not submitted
+        logger.warning(f"pre-rendering failed, rendering the automata inline: {e!r}")
+
+    return files
+
+
+def _wait_prerendered(key: str) -> None:
+    future = _prerendered.pop(key, None)
+    if future is None:
+        return
+    try:
+        with span("tikz pre-render wait", "wait"):
+            future.result()
+    except Exception as e:
+        # rendered again inline below, which reports the error; like any prefetch,
+        # this also covers a pool that broke or was shut down
+        logger.debug(f"pre-render failed: {e!r}")
+
+
+@profiled("tikzautomata.on_page_markdown")
 def on_page_markdown(
     markdown: str, page: Page, config: MkDocsConfig, files: Files, **kwargs
 ) -> str:
     if not enabled:
         return markdown
 
-    def _replace_automata(matched: re.Match) -> str:
-        options = matched.group("options")
-        contents = matched.group("contents")
-        zoom = matched.group("zoom")
-        first_line_indentation_level = get_indentation_level(matched.group("contents"))
-
-        # print(first_line_indentation_level)
+    spans = marker_spans(markdown, AUTOMATA)
+    if not spans:
+        return markdown
 
-        contents = [i for i in contents.splitlines()]
+    cached_page = CACHE and PAGE_CACHE
+    if cached_page:
+        source = markdown
+        key = _fingerprint(page.file)
+        cached = _pages().get(markdown, key)
+        if cached is not None:
+            markdown, dependencies = cached
+            _assets.update(dependencies["assets"])
+            if _background():
+                _wanted[page.file.src_path] = set(dependencies["keys"])
+                _cancel_unwanted()
+            return markdown
 
-        contents_remain = []
+    background = _background()
+    keys = set()
+    # external diagrams of this page, by file name
+    assets = {}
 
-        for idx, i in enumerate(contents):
-            if get_indentation_level(i) < first_line_indentation_level:
-                contents_remain = contents[idx:]
-                contents = contents[:idx]
-                break
+    def _render_automata(block: IndentedBlock) -> str:
+        svg_str = _native(block)
+        if svg_str is None:
+            tikzcd = _renderer(block.options, block.contents)
+            keys.add(tikzcd.filename)
+            _wait_prerendered(tikzcd.filename)
 
-        contents = "\n".join(contents)
-        tikzcd = TikZAutomataRenderer(options, contents)
+            if background and not tikzcd.is_cached():
+                if tikzcd.filename in _failed:
+                    return FAILED_HTML
+                _schedule(tikzcd)
+                return PENDING_HTML
 
-        # The string should not be splitted into lines, since markdown parser won't recognize it
-        svg_str = "".join(
-            tikzcd.write_to_svg(CACHE)
-            .replace("<?xml version='1.0' encoding='UTF-8'?>", "")
-            .splitlines()
-        )
+            # The string should not be splitted into lines, since markdown parser won't recognize it
+            svg_str = "".join(
+                tikzcd.write_to_svg(CACHE)
+                .replace("<?xml version='1.0' encoding='UTF-8'?>", "")
+                .splitlines()
+            )
 
         # bolden the stroke
         svg_str = svg_str.replace("stroke-width='0.6'", "stroke-width='0.7'")
         svg_str = svg_str.replace("stroke='none'", "stroke='#000' stroke-width='0.2'")
+        return svg_str
 
-        return (
-            matched.group("leading")
-            + f'<div style="text-align: center; zoom: {zoom if zoom else "1.5"};">{svg_str}</div>'
-            + "\n"
-            + "\n".join(contents_remain)
-        )
+    def _external_automata(svg_str: str) -> str:
+        if OPTIMIZE:
+            _, (svg_str,) = optimize_svgs([svg_str], SVG_DIGITS)
+        name = sha256(svg_str.encode()).hexdigest()[:16] + ".svg"
+        assets[name] = svg_str
+        src = get_relative_url(f"{ASSETS_DIR}/{name}", page.url)
+        return f'<img class="automata" src="{src}" alt="automata" loading="lazy" decoding="async">'
 
-    markdown = replace_indented_block_start_with_options(
-        r"(?<!\\)\\automata", _replace_automata, markdown
-    )
-    markdown = re.sub(r"\\\\automata", r"\\automata", markdown)
+    blocks = list(iter_indented_blocks(AUTOMATA, markdown))
+    svgs = []
+    sprite = ""
+    pending = False
+    if blocks:
+        svgs = [_render_automata(block) for block in blocks]
+        # placeholders of background renders stay as they are
+        rendered = [
+            i for i, svg_str in enumerate(svgs) if svg_str not in (PENDING_HTML, FAILED_HTML)
+        ]
+        pending = len(rendered) < len(svgs)
+        if EXTERNAL:
+            for i in rendered:
+                svgs[i] = _external_automata(svgs[i])
+        elif OPTIMIZE and rendered:
+            sprite, optimized = optimize_svgs([svgs[i] for i in rendered], SVG_DIGITS)
+            for i, svg_str in zip(rendered, optimized):
+                svgs[i] = svg_str
+
+    # escaped markers lose their backslash in the same pass as the blocks
+    edits = [(block.start, block.end, i) for i, block in enumerate(blocks)]
+    edits += [(start - 1, start, None) for start, _ in spans if markdown[start - 1 : start] == "\\"]
+    edits.sort(key=lambda edit: edit[0])
+    if edits:
+        parts = []
+        last = 0
+        for start, end, i in edits:
+            if start < last:
+                continue
+            parts.append(markdown[last:start])
+            last = end
+            if i is None:
+                continue
+            block, svg_str = blocks[i], svgs[i]
+            if sprite:
+                # glyphs shared by the diagrams, referenced through <use>
+                parts.append(
+                    block.leading
+                    + f'<div style="height: 0; overflow: hidden;">{sprite}</div>'
+                    + "\n"
+                )
+                sprite = ""
+            parts.append(
+                block.leading
+                + f'<div style="text-align: center; zoom: {block.zoom if block.zoom else "1.5"};">{svg_str}</div>'
+                + "\n"
+            )
+        parts.append(markdown[last:])
+        markdown = "".join(parts)
+
+    if background:
+        _wanted[page.file.src_path] = keys
+        _cancel_unwanted()
 
+    _assets.update(assets)
+    # placeholders are replaced by the rebuild after their render
+    if cached_page and not pending:
+        _pages().put(source, key, markdown, {"keys": sorted(keys), "assets": assets})
     return markdown
+
+
+def on_post_build(config: MkDocsConfig, **kwargs) -> None:
+    """
+    Write the external diagrams, then drop svgs of diagrams that no page uses
+    anymore and keep the cache bounded.
+    """
+    if not enabled:
+        return
+    if _assets:
+        assets_dir = os.path.join(config["site_dir"], ASSETS_DIR)
+        os.makedirs(assets_dir, exist_ok=True)
+        for name, svg_str in _assets.items():
+            path = os.path.join(assets_dir, name)
+            # the name is a hash of the contents, an existing file is up to date
+            if not os.path.exists(path):
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(svg_str)
+        _assets.clear()
+    if not CACHE:
+        return
+    cache = SVGCache.open(CACHE_DIR)
+    if _live is not None:
+        removed = cache.prune(_live)
+        if removed:
+            logger.info(f"removed {removed} orphaned svgs from the cache")
+    evicted = cache.evict(CACHE_MAX_BYTES)
+    if evicted:
+        logger.info(f"evicted {evicted} svgs to keep the cache under {CACHE_MAX_BYTES} bytes")
+    cache.save()
+    if _page_cache is not None:
+        _page_cache.save()
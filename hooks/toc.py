@@ -1,15 +1,31 @@
 import os
-import re
 import logging
-
-import yaml
-from jinja2 import Template
+from functools import lru_cache
 
 from mkdocs.config.defaults import MkDocsConfig
 from mkdocs.structure.pages import Page
 from mkdocs.structure.files import Files
 
-from utils.toc import get_statistics, get_update_time
+from utils.toc import (
+    dependencies_changed,
+    get_dependencies,
+    get_statistics,
+    get_update_time,
+    prefetch_toc,
+    reset_timestamp_index,
+    reset_tree_index,
+    save_tree_index,
+)
+from utils.markdown_utils import marker_spans, register_marker
+from utils.prefetch import get_prefetcher, shutdown_prefetcher
+from utils.page_cache import (
+    ENABLED as PAGE_CACHE,
+    PageCache,
+    cache_root,
+    fingerprint,
+    source_fingerprint,
+)
+from utils.profiler import profiled
 
 enabled = os.getenv("TOC", "1") == "1" or os.getenv("FULL", "0") == "true"
 logger = logging.getLogger("mkdocs.hooks.toc")
@@ -21,48 +37,216 @@ else:
 
 HOOKS_DIR = os.path.dirname(os.path.realpath(__file__))
 TEMPLATE_DIR = os.path.join(HOOKS_DIR, "templates/toc.html")
+# next to the mkdocs.yml being built, see on_config
 IGNORE_PATH = os.path.join(HOOKS_DIR, "..", ".ignored-commits")
+# below .cache so that CI saves and restores it together with the other caches
+CACHE_DIR = os.path.join(HOOKS_DIR, "..", ".cache", "toc")
+PAGES_DIR = os.path.join(HOOKS_DIR, "..", ".cache", "pages")
+BEGIN_TOC = "{{ BEGIN_TOC }}"
+END_TOC = "{{ END_TOC }}"
 
-with open(TEMPLATE_DIR, "r", encoding="utf-8") as file:
-    TEMPLATE = file.read()
+register_marker(BEGIN_TOC, END_TOC)
 
 # IGNORE_COMMITS = [
 #     {"cs/system/cs1/topic1.md": "859970b504aa527030420ff9fbfffdb1b62d71f1"},
 # ]
 
-if os.path.exists(IGNORE_PATH):
+
+@lru_cache(maxsize=None)
+def _ignore_commits() -> list:
+    """
+    The rules of the ignore commits file, read on first use.
+    """
+    if not os.path.exists(IGNORE_PATH):
+        logger.info(
+            "hook - toc: ignore commits file not found at %s; proceeding without ignore rules",
+            IGNORE_PATH,
+        )
+        return []
     with open(IGNORE_PATH, "r", encoding="utf-8") as file:
-        IGNORE_COMMITS = [
-            line.strip() for line in file if line.strip() and not line.startswith("#")
-        ]
-else:
-    IGNORE_COMMITS = []
-    logger.info(
-        "hook - toc: ignore commits file not found at %s; proceeding without ignore rules",
-        IGNORE_PATH,
+        return [line.strip() for line in file if line.strip() and not line.startswith("#")]
+
+
+def on_config(config: MkDocsConfig) -> None:
+    """
+    Read the ignore rules and keep the caches next to the mkdocs.yml being
+    built, which is this repository for the site itself.
+    """
+    global IGNORE_PATH, CACHE_DIR, PAGES_DIR
+    if not enabled:
+        return
+    cache = cache_root(config.config_file_path)
+    IGNORE_PATH = os.path.join(os.path.dirname(cache), ".ignored-commits")
+    CACHE_DIR = os.path.join(cache, "toc")
+    PAGES_DIR = os.path.join(cache, "pages")
+    _ignore_commits.cache_clear()
+
+
+def on_pre_build(config: MkDocsConfig) -> None:
+    if enabled:
+        # the history is indexed once per build, new commits show up on the next one
+        reset_timestamp_index(CACHE_DIR)
+        reset_tree_index(CACHE_DIR)
+
+
+@profiled("toc.on_files")
+def on_files(files: Files, *, config: MkDocsConfig) -> Files:
+    """
+    Start counting the files and indexing the history every TOC will read,
+    while MkDocs is busy with the rest of the pages.
+    """
+    if not enabled or get_prefetcher() is None:
+        return files
+    import yaml
+
+    prefetcher = get_prefetcher()
+    for file in files.documentation_pages():
+        try:
+            with open(file.abs_src_path, "r", encoding="utf-8") as f:
+                markdown = f.read()
+        except OSError:
+            continue
+        spans = marker_spans(markdown, BEGIN_TOC)
+        if not spans:
+            continue
+        toc_yml = _toc_yml(markdown, spans[0])
+        try:
+            toc = _parse_toc(toc_yml)
+        except yaml.YAMLError:
+            # on_page_markdown reports it
+            continue
+        base = os.path.dirname(file.abs_src_path)
+        prefetch_toc(prefetcher, _toc_links(toc), base, _ignore_commits())
+    return files
+
+
+def on_shutdown() -> None:
+    if enabled:
+        shutdown_prefetcher()
+
+
+def _toc_links(node) -> list:
+    """
+    Every link of a TOC, and maybe some more strings, which is fine to prefetch.
+    """
+    if isinstance(node, str):
+        return [node]
+    if isinstance(node, list):
+        return [link for child in node for link in _toc_links(child)]
+    if isinstance(node, dict):
+        return [link for child in node.values() for link in _toc_links(child)]
+    return []
+
+
+_page_cache = None
+
+
+def _pages() -> PageCache:
+    global _page_cache
+    if _page_cache is None:
+        _page_cache = PageCache("toc", PAGES_DIR)
+    return _page_cache
+
+
+def _fingerprint(base: str) -> str:
+    """
+    Everything a TOC depends on besides its markdown and the files it links to.
+    """
+    return fingerprint(
+        source_fingerprint(
+            os.path.realpath(__file__),
+            os.path.join(HOOKS_DIR, "utils", "toc.py"),
+            os.path.join(HOOKS_DIR, "utils", "markdown_utils.py"),
+            TEMPLATE_DIR,
+        ),
+        _ignore_commits(),
+        base,
     )
 
+
+def _unchanged(base: str, dependencies: dict) -> bool:
+    """
+    Whether the files behind the links of a cached TOC, and their update
+    times, are what they were when it was rendered.
+    """
+    if dependencies_changed(dependencies["files"]):
+        return False
+    return dependencies["times"] == [
+        get_update_time(link, base, _ignore_commits()) for link in dependencies["links"]
+    ]
+
+
+@lru_cache(maxsize=None)
+def _template():
+    from jinja2 import Template
+
+    with open(TEMPLATE_DIR, "r", encoding="utf-8") as file:
+        return Template(file.read())
+
+
+def _toc_yml(markdown: str, span: tuple[int, int]) -> str:
+    start, end = span
+    return markdown[start + len(BEGIN_TOC) : end - len(END_TOC)]
+
+
+@lru_cache(maxsize=256)
+def _parse_toc(toc_yml: str):
+    import yaml
+
+    return yaml.load(toc_yml, Loader=yaml.FullLoader)
+
+
+@profiled("toc.on_page_markdown")
 def on_page_markdown(
     markdown: str, page: Page, config: MkDocsConfig, files: Files, **kwargs
 ) -> str:
     if not enabled:
         return markdown
-    if "{{ BEGIN_TOC }}" not in markdown or "{{ END_TOC }}" not in markdown:
+    spans = marker_spans(markdown, BEGIN_TOC)
+    if not spans:
         return markdown
-    toc_yml = markdown.split("{{ BEGIN_TOC }}")[1].split("{{ END_TOC }}")[0]
-    toc = yaml.load(toc_yml, Loader=yaml.FullLoader)
-    toc_items = _get_toc_items(toc, os.path.dirname(page.file.abs_src_path))
-    toc_html = Template(TEMPLATE).render(items=toc_items)
-    markdown = re.sub(
-        r"\{\{ BEGIN_TOC \}\}.*\{\{ END_TOC \}\}",
-        toc_html,
-        markdown,
-        flags=re.IGNORECASE | re.DOTALL,
-    )
+    source = markdown
+    base = os.path.dirname(page.file.abs_src_path)
+    if PAGE_CACHE:
+        key = _fingerprint(base)
+        cached = _pages().get(markdown, key, lambda deps: _unchanged(base, deps))
+        if cached is not None:
+            return cached[0]
+
+    # a page has a single TOC, markers inside fenced code are only shown
+    start, end = spans[0]
+    toc_yml = _toc_yml(markdown, spans[0])
+    links = []
+    toc_items = _get_toc_items(_parse_toc(toc_yml), base, links)
+    toc_html = _template().render(items=toc_items)
+
+    markdown = markdown[:start] + toc_html + markdown[end:]
+    if PAGE_CACHE:
+        dependencies = {
+            "files": [
+                dependency for link in links for dependency in get_dependencies(link, base)
+            ],
+            "links": links,
+            "times": [get_update_time(link, base, _ignore_commits()) for link in links],
+        }
+        _pages().put(source, key, markdown, dependencies)
     return markdown
 
 
-def _get_toc_items(toc: dict, base: str) -> list:
+def on_post_build(config: MkDocsConfig) -> None:
+    if enabled:
+        save_tree_index()
+        if _page_cache is not None:
+            _page_cache.save()
+
+
+def _get_toc_items(toc: dict, base: str, links: list = None) -> list:
+    """
+    The items of a TOC, every link it reads statistics for is added to links.
+    """
+    if links is None:
+        links = []
+
     def _flatten_entries(entries, base, prefix=""):
         flattened = []
         for node in entries:
@@ -74,10 +258,11 @@ def _get_toc_items(toc: dict, base: str) -> list:
                     "title": title,
                     "link": link,
                 }
+                links.append(link)
                 detail["words"], detail["codes"], detail["read_time"] = get_statistics(
                     link, base
                 )
-                detail["update_time"] = get_update_time(link, base, IGNORE_COMMITS)
+                detail["update_time"] = get_update_time(link, base, _ignore_commits())
                 flattened.append(detail)
             elif isinstance(node, dict):
                 k = list(node.keys())[0]
@@ -91,10 +276,11 @@ def _get_toc_items(toc: dict, base: str) -> list:
                             "title": title,
                             "link": link,
                         }
+                        links.append(link)
                         detail["words"], detail["codes"], detail["read_time"] = get_statistics(
                             link, base
                         )
-                        detail["update_time"] = get_update_time(link, base, IGNORE_COMMITS)
+                        detail["update_time"] = get_update_time(link, base, _ignore_commits())
                         flattened.append(detail)
                     continue
                 if isinstance(v, list):
@@ -107,10 +293,11 @@ def _get_toc_items(toc: dict, base: str) -> list:
                         "title": title,
                         "link": link,
                     }
+                    links.append(link)
                     detail["words"], detail["codes"], detail["read_time"] = get_statistics(
                         link, base
                     )
-                    detail["update_time"] = get_update_time(link, base, IGNORE_COMMITS)
+                    detail["update_time"] = get_update_time(link, base, _ignore_commits())
                     if "🔒" in sk:
                         detail["lock"] = True
                     flattened.append(detail)
@@ -0,0 +1,596 @@
+"""
+TeX-free renderer for the common subset of TikZ automata.
+
+Understands `\\node[state, initial, accepting] (q) [right=of p] {$q$};`,
+`at (x,y)` placement and `\\path (p) edge [bend left] node {a} (q) ...;` with
+bends, loops and label sides, laid out on the `node distance, on grid` model
+of the default options. Anything else raises UnsupportedAutomaton, so that the
+caller can fall back to TeX.
+"""
+
+import re
+import math
+from html import escape
+from typing import Optional
+
+PT_PER_UNIT = {"pt": 1.0, "cm": 28.4528, "mm": 2.84528, "in": 72.27, "em": 10.0, "ex": 4.3}
+
+FONT_SIZE = 10.0
+SCRIPT_SIZE = 7.0
+# rough advance of a character, enough to size the picture and place labels
+CHAR_WIDTH = 0.55
+STATE_RADIUS = 12.5
+ACCEPTING_GAP = 2.0
+INITIAL_LENGTH = 13.0
+ARROW_LENGTH = 4.0
+# tikz default looseness turns into control points at this fraction of the chord
+BEND_FACTOR = 0.3915
+LOOP_SIZE = 26.0
+LOOP_SPREAD = 15
+LABEL_SEP = 3.0
+LINE_WIDTH = 0.6
+
+_SYMBOLS = {
+    "epsilon": "ε",
+    "varepsilon": "ε",
+    "lambda": "λ",
+    "Lambda": "Λ",
+    "sigma": "σ",
+    "Sigma": "Σ",
+    "delta": "δ",
+    "Delta": "Δ",
+    "alpha": "α",
+    "beta": "β",
+    "gamma": "γ",
+    "Gamma": "Γ",
+    "emptyset": "∅",
+    "varnothing": "∅",
+    "cdot": "·",
+    "ldots": "…",
+    "dots": "…",
+    "to": "→",
+    "rightarrow": "→",
+    "leftarrow": "←",
+    "times": "×",
+    "neg": "¬",
+    "lnot": "¬",
+    "mid": "|",
+    "vert": "|",
+    "sqcup": "⊔",
+    "square": "□",
+    "#": "#",
+    "$": "$",
+    "_": "_",
+    "{": "{",
+    "}": "}",
+    "%": "%",
+    "&": "&",
+    ",": " ",
+    ";": " ",
+    " ": " ",
+    "quad": "  ",
+}
+
+_DIRECTIONS = {
+    "right": (1, 0),
+    "left": (-1, 0),
+    "above": (0, 1),
+    "below": (0, -1),
+    "above right": (1, 1),
+    "above left": (-1, 1),
+    "below right": (1, -1),
+    "below left": (-1, -1),
+}
+
+_LOOP_ANGLES = {"above": 90, "below": 270, "left": 180, "right": 0}
+
+# keys of the picture options that do not change the drawing of this subset
+_IGNORED_OPTIONS = {
+    "->",
+    "auto",
+    "semithick",
+    "thick",
+    "on grid",
+}
+
+
+class UnsupportedAutomaton(ValueError):
+    pass
+
+
+def _length(value: str) -> float:
+    matched = re.fullmatch(r"\s*(-?\d*\.?\d+)\s*(pt|cm|mm|in|em|ex)?\s*", value)
+    if not matched:
+        raise UnsupportedAutomaton(f"unknown length {value!r}")
+    return float(matched.group(1)) * PT_PER_UNIT[matched.group(2) or "cm"]
+
+
+def _number(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        raise UnsupportedAutomaton(f"unknown number {value!r}") from None
+
+
+def _split_options(options: str) -> list[str]:
+    """
+    Split a key-value list on the commas outside braces and brackets.
+    """
+    parts, depth, current = [], 0, []
+    for char in options:
+        if char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current).strip())
+    return [part for part in parts if part]
+
+
+class _Scanner:
+    """
+    Tokenizer over one statement: bracket groups, parentheses, brace groups
+    and bare words.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.pos = 0
+
+    def _skip(self) -> None:
+        while self.pos < len(self.text) and self.text[self.pos].isspace():
+            self.pos += 1
+
+    def peek(self) -> str:
+        self._skip()
+        return self.text[self.pos] if self.pos < len(self.text) else ""
+
+    def done(self) -> bool:
+        return self.peek() == ""
+
+    def group(self, opening: str, closing: str) -> str:
+        self._skip()
+        if not self.text.startswith(opening, self.pos):
+            raise UnsupportedAutomaton(f"expected {opening!r} in {self.text!r}")
+        depth, start = 0, self.pos + 1
+        for idx in range(self.pos, len(self.text)):
+            char = self.text[idx]
+            if char == opening:
+                depth += 1
+            elif char == closing:
+                depth -= 1
+                if depth == 0:
+                    self.pos = idx + 1
+                    return self.text[start:idx]
+        raise UnsupportedAutomaton(f"unbalanced {opening!r} in {self.text!r}")
+
+    def word(self) -> str:
+        self._skip()
+        matched = re.compile(r"\\?[A-Za-z]+|--|\S").match(self.text, self.pos)
+        if matched is None:
+            raise UnsupportedAutomaton(f"unexpected end of {self.text!r}")
+        self.pos = matched.end()
+        return matched.group(0)
+
+
+class _State:
+    def __init__(self, name: str, x: float, y: float, label: str, options: dict) -> None:
+        self.name = name
+        self.x = x
+        self.y = y
+        self.label = label
+        self.initial = options.get("initial")
+        self.accepting = "accepting" in options
+        self.radius = max(STATE_RADIUS, _text_width(label) / 2 + 3)
+
+
+def _math_runs(label: str) -> list[tuple[str, str, bool]]:
+    """
+    Turn a label into (text, position, italic) runs, position being one of
+    "base", "sub" or "sup".
+    """
+    runs = []
+    math_mode = False
+    idx = 0
+
+    def _emit(text: str, position: str, italic: bool) -> None:
+        if runs and runs[-1][1] == position and runs[-1][2] == italic:
+            runs[-1] = (runs[-1][0] + text, position, italic)
+        else:
+            runs.append((text, position, italic))
+
+    def _atom(position: str) -> None:
+        nonlocal idx
+        char = label[idx]
+        if char == "{":
+            depth, start = 1, idx + 1
+            idx += 1
+            while idx < len(label) and depth:
+                depth += {"{": 1, "}": -1}.get(label[idx], 0)
+                idx += 1
+            for text, _, italic in _math_runs(("$" if math_mode else "") + label[start : idx - 1]):
+                _emit(text, position, italic)
+        elif char == "\\":
+            matched = re.compile(r"\\([A-Za-z]+|.)").match(label, idx)
+            name = matched.group(1)
+            idx = matched.end()
+            if name in ("text", "mathrm", "textrm", "mathit", "textit"):
+                while idx < len(label) and label[idx] == " ":
+                    idx += 1
+                if idx >= len(label) or label[idx] != "{":
+                    raise UnsupportedAutomaton(f"\\{name} without argument")
+                depth, start = 1, idx + 1
+                idx += 1
+                while idx < len(label) and depth:
+                    depth += {"{": 1, "}": -1}.get(label[idx], 0)
+                    idx += 1
+                _emit(label[start : idx - 1], position, name in ("mathit", "textit"))
+            elif name in _SYMBOLS:
+                _emit(_SYMBOLS[name], position, False)
+            else:
+                raise UnsupportedAutomaton(f"unknown command \\{name} in label")
+        else:
+            idx += 1
+            _emit(char, position, math_mode and char.isalpha())
+
+    while idx < len(label):
+        char = label[idx]
+        if char == "$":
+            math_mode = not math_mode
+            idx += 1
+        elif char in "_^" and math_mode:
+            idx += 1
+            if idx >= len(label):
+                raise UnsupportedAutomaton("dangling script in label")
+            _atom("sub" if char == "_" else "sup")
+        elif char in "_^":
+            raise UnsupportedAutomaton("script outside math mode")
+        else:
+            _atom("base")
+    return runs
+
+
+def _text_width(label: str) -> float:
+    return sum(
+        len(text) * CHAR_WIDTH * (FONT_SIZE if position == "base" else SCRIPT_SIZE)
+        for text, position, _ in _math_runs(label)
+    )
+
+
+def _text(label: str, x: float, y: float, anchor: str = "middle") -> str:
+    """
+    An svg text element with its visual center (or side, by anchor) at x, y.
+    """
+    spans = []
+    shift = 0.0
+    for text, position, italic in _math_runs(label):
+        target = {"base": 0.0, "sub": 2.5, "sup": -3.5}[position]
+        attrs = f" dy='{target - shift:g}'" if target != shift else ""
+        if position != "base":
+            attrs += f" font-size='{SCRIPT_SIZE:g}'"
+        if italic:
+            attrs += " font-style='italic'"
+        spans.append(f"<tspan{attrs}>{escape(text, quote=False)}</tspan>")
+        shift = target
+    # dominant-baseline is unreliable across browsers, shift by a third of the size
+    return (
+        f"<text x='{x:.3f}' y='{y + FONT_SIZE / 3:.3f}' text-anchor='{anchor}' "
+        f"font-family='serif' font-size='{FONT_SIZE:g}'>{''.join(spans)}</text>"
+    )
+
+
+def _point(angle: float, radius: float, x: float, y: float) -> tuple[float, float]:
+    return x + radius * math.cos(math.radians(angle)), y + radius * math.sin(math.radians(angle))
+
+
+class AutomatonRenderer:
+    """
+    Lays out and draws one automaton, coordinates in pt with y pointing up.
+    """
+
+    def __init__(self, options: Optional[str], contents: str) -> None:
+        self.node_distance = 2 * PT_PER_UNIT["cm"]
+        self.on_grid = True
+        self.bend_angle = 30.0
+        self.initial_text = ""
+        if options is None:
+            options = (
+                r"->,>={Stealth[round]},shorten >=1pt,auto,node distance=2cm,"
+                r"on grid,semithick,inner sep=2pt,bend angle=50,initial text="
+            )
+        self._picture_options(options)
+        self.states = {}
+        self.elements = []
+        self.labels = []
+        self.bounds = [math.inf, math.inf, -math.inf, -math.inf]
+        self._parse(contents)
+
+    def _picture_options(self, options: str) -> None:
+        self.on_grid = False
+        for option in _split_options(options):
+            key, _, value = (part.strip() for part in option.partition("="))
+            if option in _IGNORED_OPTIONS or key in (">", "shorten >", "inner sep"):
+                if option == "on grid":
+                    self.on_grid = True
+            elif key == "node distance":
+                self.node_distance = _length(value)
+            elif key == "bend angle":
+                self.bend_angle = _number(value)
+            elif key == "initial text":
+                self.initial_text = value
+            else:
+                raise UnsupportedAutomaton(f"unknown picture option {option!r}")
+
+    def _parse(self, contents: str) -> None:
+        contents = re.sub(r"(?<!\\)%.*", "", contents)
+        for statement in contents.split(";"):
+            statement = statement.strip()
+            if not statement:
+                continue
+            if statement.startswith("\\node"):
+                self._node(_Scanner(statement[len("\\node") :]))
+            elif statement.startswith("\\path"):
+                self._path(_Scanner(statement[len("\\path") :]))
+            elif statement.startswith("\\draw") and "edge" in statement:
+                self._path(_Scanner(statement[len("\\draw") :]))
+            else:
+                raise UnsupportedAutomaton(f"unsupported statement {statement!r}")
+
+    def _node(self, scanner: _Scanner) -> None:
+        name, label, at = None, None, None
+        options = {}
+        while not scanner.done():
+            char = scanner.peek()
+            if char == "[":
+                for option in _split_options(scanner.group("[", "]")):
+                    key, _, value = (part.strip() for part in option.partition("="))
+                    options[key] = value
+            elif char == "(":
+                name = scanner.group("(", ")").strip()
+            elif char == "{":
+                label = scanner.group("{", "}")
+            else:
+                word = scanner.word()
+                if word != "at":
+                    raise UnsupportedAutomaton(f"unexpected {word!r} in node")
+                at = scanner.group("(", ")")
+        if name is None or label is None:
+            raise UnsupportedAutomaton("node without name or label")
+
+        state_options = {}
+        position = None
+        if at is not None:
+            x, _, y = at.partition(",")
+            position = (_length(x), _length(y))
+        for key, value in options.items():
+            if key in ("state", "accepting"):
+                state_options[key] = value
+            elif key == "initial":
+                state_options["initial"] = "left"
+            elif key in ("initial where", "initial above", "initial below", "initial left", "initial right"):
+                state_options["initial"] = value or key.split()[1]
+            elif key in _DIRECTIONS:
+                position = self._relative(key, value, old=False)
+            elif key.endswith(" of") and key[:-3] in _DIRECTIONS:
+                position = self._relative(key[:-3], f"of {value}", old=True)
+            else:
+                raise UnsupportedAutomaton(f"unknown node option {key!r}")
+        if "state" not in state_options:
+            raise UnsupportedAutomaton("only state nodes are supported")
+        if position is None:
+            position = (0.0, 0.0)
+        self.states[name] = _State(name, position[0], position[1], label, state_options)
+
+    def _relative(self, direction: str, value: str, old: bool) -> tuple[float, float]:
+        matched = re.fullmatch(r"\s*(?:(.*?)\s+)?of\s+(\S+)\s*", value)
+        if not matched or matched.group(2) not in self.states:
+            raise UnsupportedAutomaton(f"cannot place {direction}={value!r}")
+        anchor = self.states[matched.group(2)]
+        distance = _length(matched.group(1)) if matched.group(1) else self.node_distance
+        dx, dy = _DIRECTIONS[direction]
+        if old and dx and dy:
+            # `above right of=` walks the distance along the diagonal
+            distance /= math.sqrt(2)
+        if not self.on_grid and not old:
+            # without on grid the distance is measured between the borders
+            distance += 2 * STATE_RADIUS
+        return anchor.x + dx * distance, anchor.y + dy * distance
+
+    def _path(self, scanner: _Scanner) -> None:
+        if scanner.peek() == "[":
+            for option in _split_options(scanner.group("[", "]")):
+                if option not in ("->", "draw", "thick", "semithick"):
+                    raise UnsupportedAutomaton(f"unknown path option {option!r}")
+        current = None
+        while not scanner.done():
+            char = scanner.peek()
+            if char == "(":
+                current = self._state(scanner.group("(", ")"))
+                continue
+            word = scanner.word()
+            if word != "edge" or current is None:
+                raise UnsupportedAutomaton(f"unexpected {word!r} in path")
+            edge_options, label, label_options = [], None, []
+            while True:
+                char = scanner.peek()
+                if char == "[":
+                    edge_options += _split_options(scanner.group("[", "]"))
+                elif char == "(":
+                    target = scanner.group("(", ")")
+                    break
+                else:
+                    if scanner.word() != "node":
+                        raise UnsupportedAutomaton("expected node or target after edge")
+                    if scanner.peek() == "[":
+                        label_options += _split_options(scanner.group("[", "]"))
+                    label = scanner.group("{", "}")
+            end = current if target.strip() == "" else self._state(target)
+            self._edge(current, end, edge_options, label, label_options)
+
+    def _state(self, name: str) -> _State:
+        name = name.strip()
+        if name not in self.states:
+            raise UnsupportedAutomaton(f"unknown node {name!r}")
+        return self.states[name]
+
+    def _edge(self, start: _State, end: _State, options: list, label: Optional[str], label_options: list) -> None:
+        bend, loop, swap, pos = 0.0, None, False, 0.5
+        for option in options + label_options:
+            key, _, value = (part.strip() for part in option.partition("="))
+            if key in ("bend left", "bend right"):
+                angle = _number(value) if value else self.bend_angle
+                bend = angle if key == "bend left" else -angle
+            elif key == "loop":
+                loop = loop or "above"
+            elif key.startswith("loop ") and key[5:] in _LOOP_ANGLES:
+                loop = key[5:]
+            elif key in ("swap", "'"):
+                swap = True
+            elif key in ("auto", "->", "midway", "above", "below", "left", "right"):
+                pass
+            elif key in ("near start", "near end", "very near start", "very near end", "pos"):
+                pos = {"near start": 0.25, "near end": 0.75, "very near start": 0.125, "very near end": 0.875}.get(key) or _number(value)
+            else:
+                raise UnsupportedAutomaton(f"unknown edge option {key!r}")
+
+        if start is end or loop:
+            if start is not end:
+                raise UnsupportedAutomaton("loop between two nodes")
+            self._loop(start, loop or "above", label)
+            return
+
+        angle = math.degrees(math.atan2(end.y - start.y, end.x - start.x))
+        p0 = _point(angle + bend, start.radius, start.x, start.y)
+        p3 = _point(angle + 180 - bend, end.radius + 1, end.x, end.y)
+        chord = math.dist(p0, p3)
+        p1 = _point(angle + bend, BEND_FACTOR * chord, *p0)
+        p2 = _point(angle + 180 - bend, BEND_FACTOR * chord, *p3)
+        self._curve(p0, p1, p2, p3, label, pos, swap)
+
+    def _loop(self, state: _State, where: str, label: Optional[str]) -> None:
+        angle = _LOOP_ANGLES[where]
+        p0 = _point(angle + LOOP_SPREAD, state.radius, state.x, state.y)
+        p3 = _point(angle - LOOP_SPREAD, state.radius + 1, state.x, state.y)
+        p1 = _point(angle + LOOP_SPREAD + 15, LOOP_SIZE, *p0)
+        p2 = _point(angle - LOOP_SPREAD - 15, LOOP_SIZE, *p3)
+        self._curve(p0, p1, p2, p3, label, 0.5, False, outward=angle)
+
+    def _curve(self, p0, p1, p2, p3, label, pos, swap, outward=None) -> None:
+        self._path_element(
+            f"M{p0[0]:.3f} {-p0[1]:.3f}C{p1[0]:.3f} {-p1[1]:.3f} "
+            f"{p2[0]:.3f} {-p2[1]:.3f} {p3[0]:.3f} {-p3[1]:.3f}",
+            [p0, p1, p2, p3],
+        )
+        self._arrow_head(p3, math.atan2(p3[1] - p2[1], p3[0] - p2[0]))
+        if label is None:
+            return
+
+        t = pos
+        point = tuple(
+            (1 - t) ** 3 * a + 3 * (1 - t) ** 2 * t * b + 3 * (1 - t) * t**2 * c + t**3 * d
+            for a, b, c, d in zip(p0, p1, p2, p3)
+        )
+        if outward is None:
+            tangent = tuple(
+                3 * (1 - t) ** 2 * (b - a) + 6 * (1 - t) * t * (c - b) + 3 * t**2 * (d - c)
+                for a, b, c, d in zip(p0, p1, p2, p3)
+            )
+            # auto places the label on the left of the direction of travel
+            normal = math.atan2(tangent[1], tangent[0]) + (-math.pi / 2 if swap else math.pi / 2)
+        else:
+            normal = math.radians(outward)
+        self._label(label, point, normal)
+
+    def _label(self, label: str, point: tuple, normal: float) -> None:
+        width = _text_width(label)
+        nx, ny = math.cos(normal), math.sin(normal)
+        # push the label box out until it clears the line
+        offset = LABEL_SEP + abs(nx) * width / 2 + abs(ny) * FONT_SIZE / 2
+        x, y = point[0] + nx * offset, point[1] + ny * offset
+        self.labels.append(_text(label, x, -y))
+        self._extend(x - width / 2, y - FONT_SIZE / 2)
+        self._extend(x + width / 2, y + FONT_SIZE / 2)
+
+    def _path_element(self, d: str, points: list) -> None:
+        self.elements.append(
+            f"<path d='{d}' fill='none' stroke='#000' stroke-width='{LINE_WIDTH}'/>"
+        )
+        for x, y in points:
+            self._extend(x, y)
+
+    def _arrow_head(self, tip: tuple, angle: float) -> None:
+        back = _point(math.degrees(angle) + 180, ARROW_LENGTH, *tip)
+        left = _point(math.degrees(angle) + 90, ARROW_LENGTH * 0.45, *back)
+        right = _point(math.degrees(angle) - 90, ARROW_LENGTH * 0.45, *back)
+        inner = _point(math.degrees(angle) + 180, ARROW_LENGTH * 0.75, *tip)
+        self.elements.append(
+            f"<path d='M{tip[0]:.3f} {-tip[1]:.3f}L{left[0]:.3f} {-left[1]:.3f}"
+            f"L{inner[0]:.3f} {-inner[1]:.3f}L{right[0]:.3f} {-right[1]:.3f}Z' "
+            f"stroke='#000' stroke-width='{LINE_WIDTH}' stroke-linejoin='round'/>"
+        )
+
+    def _extend(self, x: float, y: float) -> None:
+        self.bounds = [
+            min(self.bounds[0], x),
+            min(self.bounds[1], y),
+            max(self.bounds[2], x),
+            max(self.bounds[3], y),
+        ]
+
+    def _circle(self, x: float, y: float, r: float) -> None:
+        self._path_element(
+            f"M{x - r:.3f} {-y:.3f}a{r:.3f} {r:.3f} 0 1 0 {2 * r:.3f} 0"
+            f"a{r:.3f} {r:.3f} 0 1 0 {-2 * r:.3f} 0Z",
+            [(x - r, y - r), (x + r, y + r)],
+        )
+
+    def _draw_states(self) -> None:
+        for state in self.states.values():
+            self._circle(state.x, state.y, state.radius)
+            if state.accepting:
+                self._circle(state.x, state.y, state.radius - ACCEPTING_GAP)
+            self.labels.append(_text(state.label, state.x, -state.y))
+            if state.initial:
+                angle = {"left": 180, "right": 0, "above": 90, "below": 270}.get(state.initial)
+                if angle is None:
+                    raise UnsupportedAutomaton(f"initial where={state.initial!r}")
+                tip = _point(angle, state.radius + 1, state.x, state.y)
+                tail = _point(angle, state.radius + INITIAL_LENGTH, state.x, state.y)
+                self._path_element(
+                    f"M{tail[0]:.3f} {-tail[1]:.3f}L{tip[0]:.3f} {-tip[1]:.3f}", [tail, tip]
+                )
+                self._arrow_head(tip, math.radians(angle + 180))
+                if self.initial_text:
+                    self._label(self.initial_text, tail, math.radians(angle))
+
+    def to_svg(self) -> str:
+        if not self.states:
+            raise UnsupportedAutomaton("no states")
+        self._draw_states()
+        pad = 2.0
+        left, bottom, right, top = self.bounds
+        width, height = right - left + 2 * pad, top - bottom + 2 * pad
+        return (
+            "<svg version='1.1' xmlns='http://www.w3.org/2000/svg' class='automata-native' "
+            f"width='{width:.3f}pt' height='{height:.3f}pt' "
+            f"viewBox='{left - pad:.3f} {-top - pad:.3f} {width:.3f} {height:.3f}'>"
+            f"<g>{''.join(self.elements)}{''.join(self.labels)}</g></svg>"
+        )
+
+
+def render_automaton(options: Optional[str], contents: str) -> str:
+    """
+    Render an automaton straight to svg, raising UnsupportedAutomaton for
+    anything outside the supported subset.
+    """
+    try:
+        return AutomatonRenderer(options, contents).to_svg()
+    except UnsupportedAutomaton:
+        raise
+    except (ValueError, AttributeError, IndexError, KeyError) as e:
+        # valid TikZ the parser did not expect, TeX can still draw it
+        raise UnsupportedAutomaton(f"cannot parse: {e}") from e
@@ -0,0 +1,102 @@
+import re
+from typing import Iterator, NamedTuple, Optional
+
+VOID_ELEMENTS = frozenset(
+    [
+        "area",
+        "base",
+        "br",
+        "col",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        "link",
+        "meta",
+        "source",
+        "track",
+        "wbr",
+    ]
+)
+RAW_TEXT_ELEMENTS = frozenset(["script", "style"])
+
+_TOKEN = re.compile(
+    r"<!--.*?-->"
+    r"|<!\[CDATA\[.*?\]\]>"
+    r"|<![^>]*>"
+    r"|<(?P<closing>/?)(?P<name>[A-Za-z][^\s/>]*)"
+    r"(?P<attrs>(?:\s+[^\s=/>]+(?:\s*=\s*(?:\"[^\"]*\"|'[^']*'|[^\s>]+))?)*)"
+    r"\s*(?P<self_closing>/?)>",
+    re.S,
+)
+_RAW_TEXT_END = {name: re.compile(f"</{name}", re.I) for name in RAW_TEXT_ELEMENTS}
+_CLASS = re.compile(r"""\sclass\s*=\s*(?:"(?P<dq>[^"]*)"|'(?P<sq>[^']*)'|(?P<bare>[^\s"'>]+))""")
+
+
+class Tag(NamedTuple):
+    start: int
+    end: int
+    # empty for comments, doctypes and CDATA sections
+    name: str
+    closing: bool
+    self_closing: bool
+    # where the attributes start and end in the document
+    attrs_start: int
+    attrs_end: int
+
+
+def parse_tag(html: str, pos: int) -> Optional[Tag]:
+    """
+    The tag starting exactly at pos, if there is one.
+    """
+    matched = _TOKEN.match(html, pos)
+    return _tag(matched) if matched else None
+
+
+def _tag(matched: re.Match) -> Tag:
+    if matched.group("name") is None:
+        return Tag(matched.start(), matched.end(), "", False, False, matched.end(), matched.end())
+    name = matched.group("name").lower()
+    return Tag(
+        matched.start(),
+        matched.end(),
+        name,
+        matched.group("closing") == "/",
+        matched.group("self_closing") == "/" or name in VOID_ELEMENTS,
+        matched.start("attrs"),
+        matched.end("attrs"),
+    )
+
+
+def iter_tags(html: str, pos: int = 0) -> Iterator[Tag]:
+    """
+    The tags and comments of html from pos on, in document order, skipping
+    over the contents of script and style elements.
+    """
+    while True:
+        matched = _TOKEN.search(html, pos)
+        if not matched:
+            return
+        tag = _tag(matched)
+        yield tag
+        pos = tag.end
+        if tag.name in RAW_TEXT_ELEMENTS and not tag.closing and not tag.self_closing:
+            close = _RAW_TEXT_END[tag.name].search(html, pos)
+            pos = close.start() if close else len(html)
+
+
+def class_attribute(html: str, tag: Tag) -> Optional[tuple[int, int, str]]:
+    """
+    The span of the quoted value of the class attribute of tag and the value
+    itself, or None if it has none.
+    """
+    matched = _CLASS.search(html, tag.attrs_start, tag.attrs_end)
+    if not matched:
+        return None
+    for group in ("dq", "sq", "bare"):
+        if matched.group(group) is not None:
+            start, end = matched.span(group)
+            if group != "bare":
+                start, end = start - 1, end + 1
+            return start, end, matched.group(group)
+    return None
@@ -1,16 +1,227 @@
 import re
+from typing import Callable, Iterator, NamedTuple, Optional
 
 
 def replace_standalone_words(word: str, target: str, string: str) -> str:
     return re.sub(f"\\b{word}\\b", target, string)
 
 
-def replace_indented_block_start_with_options(target, handle, string):
-    return re.sub(
-        rf"(?P<leading>[ \t]*?)({target}(\[(?P<options>.*)\])?(\\zoom{{(?P<zoom>.*)}})?.*\n(?P<contents>(((?P=leading)(\t|(    )).*)|\n)*))",
-        handle,
-        string,
+class IndentedBlock(NamedTuple):
+    """
+    A command block such as
+
+        \\marker[options]\\zoom{zoom}
+            contents
+
+    `start` and `end` delimit the text from the leading indent of the marker
+    up to the end of the last line of contents.
+    """
+
+    start: int
+    end: int
+    leading: str
+    options: Optional[str]
+    zoom: Optional[str]
+    contents: str
+
+
+class MarkdownScan(NamedTuple):
+    """
+    Where the fenced code blocks and the registered markers of a page are.
+    """
+
+    text: str
+    # (start, end) of every fenced code block, fences included
+    fences: list
+    # marker -> positions of the marker outside fenced code, in order
+    markers: dict
+
+
+# begin marker -> end marker that closes it, or None
+_markers = {}
+# every begin and end marker, longest first
+_literals = ()
+_pattern = None
+_last_scan = None
+
+
+def register_marker(begin: str, end: Optional[str] = None) -> None:
+    """
+    Have scan_markdown look for begin, and for end too if a span of the page
+    runs from begin to the next end.
+    """
+    global _literals, _pattern, _last_scan
+    if begin in _markers and _markers[begin] == end:
+        return
+    _markers[begin] = end
+    _literals = tuple(
+        sorted({*_markers, *(e for e in _markers.values() if e)}, key=len, reverse=True)
+    )
+    # a fence opens at the start of a line, the scan runs over "\n" + text
+    _pattern = re.compile(
+        r"\n[ \t]*(?P<fence>`{3,}|~{3,})|" + "|".join(re.escape(literal) for literal in _literals)
     )
+    _last_scan = None
+
+
+def scan_markdown(text: str) -> MarkdownScan:
+    """
+    Find the fenced code blocks and every registered marker outside of them
+    in a single pass over text.
+
+    Most pages hold no marker at all, which a substring search per marker
+    tells much faster than the regex, so those pages are never tokenized.
+    The scan of the last text is kept, so that hooks looking at the same
+    page one after another only pay for it once.
+    """
+    global _last_scan
+    if _last_scan is not None and (_last_scan.text is text or _last_scan.text == text):
+        return _last_scan
+    fences = []
+    markers = {}
+    fence = None
+    fence_start = 0
+    if any(literal in text for literal in _literals):
+        for matched in _pattern.finditer("\n" + text):
+            opening = matched.group("fence")
+            if opening is not None:
+                # the fence line starts right after the matched newline
+                if fence is None:
+                    fence, fence_start = opening, matched.start()
+                elif opening[0] == fence[0] and len(opening) >= len(fence):
+                    line_end = text.find("\n", matched.end() - 1)
+                    end = len(text) if line_end < 0 else line_end + 1
+                    fences.append((fence_start, end))
+                    fence = None
+            elif fence is None:
+                # the position in text, without the newline in front
+                markers.setdefault(matched.group(), []).append(matched.start() - 1)
+        if fence is not None:
+            fences.append((fence_start, len(text)))
+    _last_scan = MarkdownScan(text, fences, markers)
+    return _last_scan
+
+
+def marker_spans(text: str, begin: str) -> list[tuple[int, int]]:
+    """
+    The (start, end) of every occurrence of a registered marker outside
+    fenced code, running up to the end of the end marker for pairs. A begin
+    without an end after it is not a span.
+    """
+    scan = scan_markdown(text)
+    starts = scan.markers.get(begin, [])
+    end = _markers[begin]
+    if end is None:
+        return [(start, start + len(begin)) for start in starts]
+    spans = []
+    ends = scan.markers.get(end, [])
+    i = 0
+    last = -1
+    for start in starts:
+        if start < last:
+            continue
+        while i < len(ends) and ends[i] < start + len(begin):
+            i += 1
+        if i == len(ends):
+            break
+        last = ends[i] + len(end)
+        spans.append((start, last))
+        i += 1
+    return spans
+
+
+def _parse_marker_line(line: str, marker: str) -> Optional[tuple[int, str, Optional[str], Optional[str]]]:
+    """
+    Find an unescaped marker in line, return its column, leading indent,
+    options and zoom.
+    """
+    idx = line.find(marker)
+    while idx > 0 and line[idx - 1] == "\\":
+        idx = line.find(marker, idx + 1)
+    if idx < 0:
+        return None
+
+    column = idx
+    while column > 0 and line[column - 1] in " \t":
+        column -= 1
+    leading = line[column:idx]
+
+    rest = line[idx + len(marker) :]
+    options = zoom = None
+    if rest.startswith("["):
+        close = rest.rfind("]")
+        if close > 0:
+            options = rest[1:close]
+            rest = rest[close + 1 :]
+    if rest.startswith("\\zoom{"):
+        close = rest.rfind("}")
+        if close > 0:
+            zoom = rest[len("\\zoom{") : close]
+    return column, leading, options, zoom
+
+
+def iter_indented_blocks(marker: str, string: str) -> Iterator[IndentedBlock]:
+    """
+    Blocks started by marker, found through scan_markdown.
+
+    The contents are the lines right below the marker that are indented one
+    level deeper than it; they end at the first blank or less indented line.
+    Markers escaped by a backslash and anything inside fenced code are skipped.
+    """
+    register_marker(marker)
+    end = 0
+    for position in scan_markdown(string).markers.get(marker, []):
+        if position < end:
+            # on a line already looked at, or inside the contents of a block
+            continue
+        line_start = string.rfind("\n", 0, position) + 1
+        line_end = string.find("\n", position)
+        if line_end < 0:
+            return
+        end = line_end + 1
+        parsed = _parse_marker_line(string[line_start:end], marker)
+        if parsed is None:
+            continue
+        column, leading, options, zoom = parsed
+
+        contents = []
+        level = None
+        while end < len(string):
+            next_end = string.find("\n", end)
+            next_end = len(string) if next_end < 0 else next_end + 1
+            body = string[end:next_end].rstrip("\r\n")
+            if not (
+                body.startswith(leading + "\t") or body.startswith(leading + "    ")
+            ):
+                break
+            if level is None:
+                level = get_indentation_level(body)
+            elif get_indentation_level(body) < level:
+                break
+            contents.append(body)
+            end = next_end
+
+        yield IndentedBlock(
+            line_start + column, end, leading, options, zoom, "\n".join(contents)
+        )
+
+
+def replace_indented_block_start_with_options(
+    marker: str, handle: Callable[[IndentedBlock], str], string: str
+) -> str:
+    """
+    Replace every block started by marker with the result of handle(block).
+    """
+    parts = []
+    last = 0
+    for block in iter_indented_blocks(marker, string):
+        parts.append(string[last : block.start])
+        parts.append(handle(block))
+        last = block.end
+    if not parts:
+        return string
+    parts.append(string[last:])
+    return "".join(parts)
 
 
 def get_indentation_level(str):
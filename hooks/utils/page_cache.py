@@ -0,0 +1,139 @@
+import os
+import json
+import tempfile
+from functools import lru_cache
+from hashlib import sha256
+from typing import Any, Callable, Optional
+
+from mkdocs.utils import log
+
+from .profiler import count
+
+# reuse the output of markdown hooks across builds, 0 to always run them
+ENABLED = os.getenv("PAGE_CACHE", "1") == "1"
+HOOKS_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def cache_root(config_file_path: Optional[str]) -> str:
+    """
+    The .cache directory next to the mkdocs.yml being built, so that another
+    site using these hooks, like the benchmark corpus, never evicts the
+    entries of this one.
+    """
+    if config_file_path is None:
+        return os.path.join(HOOKS_DIR, "..", ".cache")
+    return os.path.join(os.path.dirname(os.path.abspath(config_file_path)), ".cache")
+
+
+@lru_cache(maxsize=None)
+def source_fingerprint(*paths: str) -> str:
+    """
+    Hash of the given source files, so that entries written by an older
+    version of a hook are never read back.
+    """
+    digest = sha256()
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        except OSError:
+            digest.update(path.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def fingerprint(*parts) -> str:
+    return sha256("\0".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class PageCache:
+    """
+    Output of a markdown hook for the pages it has seen before.
+
+    An entry is found by the hash of the markdown a page came in with and a
+    fingerprint of everything else the output depends on that the hook knows
+    up front: its sources, templates and flags. What only turns up while
+    computing the output, such as the files a TOC reads, is kept in the entry
+    as dependencies, which the hook checks before a hit is taken.
+
+    Entries are saved to cache_dir/<name>.json at the end of a build. Those
+    the build did not look up are dropped then, like removed pages.
+    """
+
+    VERSION = 1
+
+    def __init__(self, name: str, cache_dir: Optional[str] = None) -> None:
+        self.name = name
+        self.cache_file = os.path.join(cache_dir, f"{name}.json") if cache_dir else None
+        # key -> {"output": str, "deps": any}
+        self.entries = self._load()
+        # keys looked up or stored during this build
+        self.used = set()
+        self.changed = False
+
+    def _load(self) -> dict:
+        if not self.cache_file:
+            return {}
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if cached.get("version") != self.VERSION:
+            return {}
+        return cached.get("entries", {})
+
+    @staticmethod
+    def key(markdown: str, fingerprint: str) -> str:
+        return sha256(f"{fingerprint}\0{markdown}".encode()).hexdigest()
+
+    def get(
+        self, markdown: str, fingerprint: str, valid: Optional[Callable[[Any], bool]] = None
+    ) -> Optional[tuple[str, Any]]:
+        """
+        The output and dependencies stored for markdown, or None if there are
+        none or valid says the dependencies changed.
+        """
+        key = self.key(markdown, fingerprint)
+        entry = self.entries.get(key)
+        if entry is None or (valid is not None and not valid(entry["deps"])):
+            count(f"{self.name} page cache miss")
+            return None
+        count(f"{self.name} page cache hit")
+        self.used.add(key)
+        return entry["output"], entry["deps"]
+
+    def peek(self, markdown: str, fingerprint: str) -> Optional[Any]:
+        """
+        The dependencies stored for markdown, or None, without the lookup
+        counting as a hit or miss or keeping the entry.
+        """
+        entry = self.entries.get(self.key(markdown, fingerprint))
+        return None if entry is None else entry["deps"]
+
+    def put(self, markdown: str, fingerprint: str, output: str, deps: Any = None) -> None:
+        key = self.key(markdown, fingerprint)
+        self.entries[key] = {"output": output, "deps": deps}
+        self.used.add(key)
+        self.changed = True
+
+    def save(self) -> None:
+        """
+        Write the entries of this build, and start tracking the next one.
+        """
+        entries = {key: self.entries[key] for key in self.used if key in self.entries}
+        changed = self.changed or len(entries) != len(self.entries)
+        self.entries = entries
+        self.used = set()
+        self.changed = False
+        if not self.cache_file or not changed:
+            return
+        cache_dir = os.path.dirname(self.cache_file)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"version": self.VERSION, "entries": entries}, f, ensure_ascii=False)
+            os.replace(tmp, self.cache_file)
+        except OSError:
+            log.error(f"[page_cache] unable to write {self.cache_file}")
@@ -0,0 +1,109 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from mkdocs.utils import log
+
+# work the hooks schedule in on_files, so that the page loop mostly collects results
+PREFETCH = os.getenv("PREFETCH", "1") == "1"
+WORKERS = int(os.getenv("PREFETCH_WORKERS", "0")) or os.cpu_count() or 1
+HOOKS_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+class Prefetcher:
+    """
+    Thread and process pools shared by the hooks for the work they know of
+    before the pages are rendered.
+
+    Subprocess-bound work such as git or TeX goes to the threads, CPU-bound
+    work to the processes, whose functions and arguments must be picklable.
+    Both pools are created on first use and kept across the rebuilds of
+    `mkdocs serve`. Callers keep the returned futures and wait on them from
+    on_page_markdown. Once the process pool breaks, every later call returns
+    a failed future, so that the callers do the work themselves.
+    """
+
+    def __init__(self, workers: int = WORKERS) -> None:
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._threads = None
+        self._processes = None
+        self._broken = None
+
+    def thread(self, fn: Callable, *args) -> Future:
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="prefetch"
+                )
+            return self._threads.submit(fn, *args)
+
+    def process(self, fn: Callable, *args) -> Future:
+        with self._lock:
+            if self._broken is None and self._processes is None:
+                # pulls in multiprocessing, so only once something needs it
+                from concurrent.futures import ProcessPoolExecutor
+
+                # MkDocs only puts the hooks on sys.path while loading them, so
+                # spawned workers could not unpickle anything from `utils`
+                self._processes = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=exec,
+                    initargs=(f"import sys; sys.path.insert(0, {HOOKS_DIR!r})",),
+                )
+            if self._broken is None:
+                try:
+                    return self._processes.submit(fn, *args)
+                except RuntimeError as e:
+                    # BrokenProcessPool, or a pool that was shut down under us
+                    log.warning(f"[prefetch] process pool failed, working inline: {e!r}")
+                    self._processes.shutdown(wait=False, cancel_futures=True)
+                    self._processes = None
+                    self._broken = e
+            future = Future()
+            future.set_exception(self._broken)
+            return future
+
+    def shutdown(self) -> None:
+        with self._lock:
+            for pool in (self._threads, self._processes):
+                if pool is not None:
+                    pool.shutdown(wait=False, cancel_futures=True)
+            self._threads = None
+            self._processes = None
+
+
+_prefetcher = None
+
+
+def get_prefetcher() -> Optional[Prefetcher]:
+    """
+    The prefetcher shared by all hooks, or None if prefetching is disabled.
+    """
+    global _prefetcher
+    if not PREFETCH:
+        return None
+    if _prefetcher is None:
+        _prefetcher = Prefetcher()
+        log.debug(f"[prefetch] using {_prefetcher.workers} workers")
+    return _prefetcher
+
+
+def shutdown_prefetcher() -> None:
+    if _prefetcher is not None:
+        _prefetcher.shutdown()
+
+
+def wait(future: Optional[Future]):
+    """
+    The result of a prefetch, or None if there was none or it failed, in which
+    case the caller does the work itself and reports the error.
+    """
+    if future is None or future.cancelled():
+        return None
+    try:
+        return future.result()
+    except Exception as e:
+        log.debug(f"[prefetch] failed: {e!r}")
+        return None
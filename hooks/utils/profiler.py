@@ -0,0 +1,229 @@
+import os
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import TYPE_CHECKING, Callable, Optional
+
+# everything else is imported by the Profiler, which only exists when profiling
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+# time the hooks, their subprocesses and caches, written out by the buildprofile hook
+PROFILE = os.getenv("PROFILE", "0") == "1"
+HOOKS_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+PROFILE_DIR = os.getenv("PROFILE_DIR") or os.path.join(HOOKS_DIR, "..", ".cache", "profile")
+# rows of the slowest pages table
+TOP = int(os.getenv("PROFILE_TOP", "20"))
+
+_NULL = nullcontext()
+
+
+class Profiler:
+    """
+    Spans and counters of one build.
+
+    Spans are kept as Chrome trace complete events, so that the trace opens
+    in chrome://tracing or Perfetto with a row per thread. Spans recorded for
+    a page carry its src path and make up the slowest pages table. Work done
+    in the prefetch processes is only seen from the outside, as the span from
+    submitting a batch to its result.
+    """
+
+    def __init__(self) -> None:
+        import threading
+        import time
+
+        self._lock = threading.Lock()
+        self._clock = time.perf_counter_ns
+        self._current_thread = threading.current_thread
+        self.reset()
+
+    def reset(self) -> None:
+        from collections import Counter
+
+        with self._lock:
+            self.origin = self._clock()
+            self.events = []
+            self.counters = Counter()
+            self.threads = {}
+
+    def now(self) -> int:
+        return self._clock()
+
+    def add(self, name: str, category: str, start: int, end: int, **args) -> None:
+        thread = self._current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self.origin) / 1000,
+            "dur": (end - start) / 1000,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+            self.threads[thread.ident] = thread.name
+
+    @contextmanager
+    def span(self, name: str, category: str, **args):
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, self.now(), **args)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += n
+
+    def trace(self) -> dict:
+        pid = os.getpid()
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in self.threads.items()
+        ]
+        return {
+            "traceEvents": metadata + self.events,
+            "displayTimeUnit": "ms",
+            "otherData": {"counters": dict(self.counters)},
+        }
+
+    def slowest_pages(self, top: int = TOP) -> list[tuple[str, float, dict]]:
+        """
+        The pages that took the hooks the longest, as (src path, total ms,
+        ms by span name), slowest first.
+        """
+        from collections import defaultdict
+
+        pages = defaultdict(lambda: defaultdict(float))
+        for event in self.events:
+            page = event.get("args", {}).get("page")
+            if page is not None and event["cat"] == "hook":
+                pages[page][event["name"]] += event["dur"] / 1000
+        totals = [(page, sum(spans.values()), dict(spans)) for page, spans in pages.items()]
+        totals.sort(key=lambda row: row[1], reverse=True)
+        return totals[:top]
+
+    def summary(self, top: int = TOP) -> str:
+        from collections import defaultdict
+
+        rows = self.slowest_pages(top)
+        # disabled hooks are still called, but take no measurable time
+        names = sorted(
+            {name for _, _, spans in rows for name, ms in spans.items() if ms >= 0.05}
+        )
+        width = max([len("page")] + [_width(page) for page, _, _ in rows])
+        lines = [_pad("page", width) + f" {'total':>9}" + "".join(f" {name:>24}" for name in names)]
+        for page, total, spans in rows:
+            lines.append(
+                _pad(page, width)
+                + f" {total:>7.1f}ms"
+                + "".join(f" {spans.get(name, 0):>22.1f}ms" for name in names)
+            )
+
+        by_name = defaultdict(lambda: [0, 0.0])
+        for event in self.events:
+            by_name[event["name"]][0] += 1
+            by_name[event["name"]][1] += event["dur"] / 1000
+        lines.append("")
+        lines.append(f"{'span':<32} {'calls':>7} {'total':>11}")
+        for name, (calls, total) in sorted(by_name.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<32} {calls:>7} {total:>9.1f}ms")
+
+        if self.counters:
+            lines.append("")
+            lines.extend(f"{name:<32} {n:>7}" for name, n in sorted(self.counters.items()))
+        return "\n".join(lines)
+
+    def write(self, directory: str) -> tuple[str, str]:
+        """
+        Write the trace and the summary into directory, return their paths.
+        """
+        import json
+
+        os.makedirs(directory, exist_ok=True)
+        trace_path = os.path.join(directory, "trace.json")
+        summary_path = os.path.join(directory, "summary.txt")
+        with open(trace_path, "w", encoding="utf-8") as f:
+            json.dump(self.trace(), f)
+        with open(summary_path, "w", encoding="utf-8") as f:
+            f.write(self.summary() + "\n")
+        return trace_path, summary_path
+
+
+def _width(text: str) -> int:
+    """
+    Columns text takes up in a terminal, where CJK characters are two wide.
+    """
+    import unicodedata
+
+    return sum(2 if unicodedata.east_asian_width(c) in "WF" else 1 for c in text)
+
+
+def _pad(text: str, width: int) -> str:
+    return text + " " * (width - _width(text))
+
+
+_profiler = Profiler() if PROFILE else None
+
+
+def get_profiler() -> Optional[Profiler]:
+    """
+    The profiler of the build, or None if profiling is disabled.
+    """
+    return _profiler
+
+
+def span(name: str, category: str = "hook", **args):
+    """
+    Context manager timing its body, doing nothing unless profiling.
+    """
+    if _profiler is None:
+        return _NULL
+    return _profiler.span(name, category, **args)
+
+
+def count(name: str, n: int = 1) -> None:
+    if _profiler is not None:
+        _profiler.count(name, n)
+
+
+def track(future: "Future", name: str, category: str = "process", **args) -> None:
+    """
+    Time a future from now until it is done, for work the profiler cannot see
+    from the inside.
+    """
+    if _profiler is None:
+        return
+    start = _profiler.now()
+
+    def done(_) -> None:
+        # a batch cancelled by a rebuild belongs to a profile that is gone
+        if start >= _profiler.origin:
+            _profiler.add(name, category, start, _profiler.now(), **args)
+
+    future.add_done_callback(done)
+
+
+def profiled(name: str) -> Callable[[Callable], Callable]:
+    """
+    Time every call of a hook event, attributed to the page it is called
+    for. Leaves the function untouched unless profiling.
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        if _profiler is None:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            page = kwargs.get("page")
+            extra = {"page": page.file.src_path} if page is not None else {}
+            with _profiler.span(name, "hook", **extra):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from hashlib import sha256
+from typing import Iterable, Optional
+
+from mkdocs.utils import log
+
+
+class SVGCache:
+    """
+    Content-addressed store of rendered svgs.
+
+    Every entry is `<key>.svg` below root, where the key hashes all inputs of
+    the render. A manifest records size and last access of each entry, which
+    drives the LRU eviction and the removal of orphans. Files are written to a
+    temporary name and renamed into place, so a crashed or concurrent writer
+    never leaves a truncated svg behind. Pool workers may write entries without
+    touching the manifest; the owning process picks them up on save. Within a
+    process, the entries are shared with the background renders of `mkdocs
+    serve` and only touched under a lock.
+    """
+
+    MANIFEST = "manifest.json"
+    VERSION = 1
+    # seconds after which a temporary file is considered abandoned
+    STALE_TMP = 3600
+
+    _instances = {}
+
+    def __init__(self, root: str) -> None:
+        self.root = os.path.abspath(root)
+        self.entries = None
+        # keys seen during this build, everything else is an orphan
+        self.live = set()
+        # reentrant, prune and evict go through _sync and _remove
+        self._lock = threading.RLock()
+
+    @classmethod
+    def open(cls, root: str) -> "SVGCache":
+        """
+        The cache of root shared by everything in this process.
+        """
+        root = os.path.abspath(root)
+        if root not in cls._instances:
+            cls._instances[root] = cls(root)
+        return cls._instances[root]
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        return sha256("\0".join(parts).encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.svg")
+
+    def _load(self) -> dict:
+        if self.entries is None:
+            try:
+                with open(os.path.join(self.root, self.MANIFEST), "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                if manifest.get("version") != self.VERSION:
+                    raise ValueError("manifest version mismatch")
+                self.entries = manifest["entries"]
+            except (OSError, ValueError, KeyError):
+                self.entries = {}
+        return self.entries
+
+    def contains(self, key: str) -> bool:
+        if os.path.exists(self.path(key)):
+            with self._lock:
+                self.live.add(key)
+            return True
+        return False
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with open(self.path(key), "r", encoding="utf-8") as f:
+                svg_str = f.read(None)
+        except OSError:
+            return None
+        with self._lock:
+            self._load()[key] = {"size": len(svg_str.encode()), "atime": time.time()}
+            self.live.add(key)
+        return svg_str
+
+    def put(self, key: str, svg_str: str) -> None:
+        data = svg_str.encode()
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self.path(key))
+        except OSError:
+            log.error(f"[svg_cache] unable to write {self.path(key)}")
+            return
+        with self._lock:
+            if self.entries is not None:
+                self.entries[key] = {"size": len(data), "atime": time.time()}
+            self.live.add(key)
+
+    def _sync(self) -> dict:
+        """
+        Reconcile the manifest with the files actually present below root,
+        with the lock held.
+        """
+        entries = self._load()
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            names = []
+        present = set()
+        for name in names:
+            if name.endswith(".tmp"):
+                # left behind by a writer that died before its rename
+                try:
+                    tmp = os.path.join(self.root, name)
+                    if os.stat(tmp).st_mtime < time.time() - self.STALE_TMP:
+                        os.remove(tmp)
+                except OSError:
+                    pass
+            elif name.endswith(".svg"):
+                key = name[:-4]
+                present.add(key)
+                if key not in entries:
+                    stat = os.stat(os.path.join(self.root, name))
+                    entries[key] = {"size": stat.st_size, "atime": stat.st_mtime}
+        for key in list(entries):
+            if key not in present:
+                del entries[key]
+        return entries
+
+    def _remove(self, key: str) -> None:
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._load().pop(key, None)
+
+    def prune(self, live: Optional[Iterable[str]] = None) -> int:
+        """
+        Remove every entry that is not live, return how many were removed.
+        """
+        with self._lock:
+            live = set(self.live) if live is None else set(live) | self.live
+            orphans = [key for key in self._sync() if key not in live]
+            for key in orphans:
+                self._remove(key)
+        return len(orphans)
+
+    def evict(self, max_bytes: int) -> int:
+        """
+        Drop least recently used entries until the cache fits in max_bytes.
+        """
+        with self._lock:
+            entries = self._sync()
+            total = sum(entry["size"] for entry in entries.values())
+            evicted = 0
+            for key in sorted(entries, key=lambda k: entries[k]["atime"]):
+                if total <= max_bytes:
+                    break
+                total -= entries[key]["size"]
+                self._remove(key)
+                evicted += 1
+        return evicted
+
+    def save(self) -> None:
+        with self._lock:
+            entries = dict(self._sync())
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"version": self.VERSION, "entries": entries}, f)
+            os.replace(tmp, os.path.join(self.root, self.MANIFEST))
+        except OSError:
+            log.error(f"[svg_cache] unable to write the manifest in {self.root}")
@@ -0,0 +1,113 @@
+import re
+from hashlib import sha1
+
+_NUMBER_ATTRIBUTE = re.compile(
+    r"""(\s(?:d|x|y|x1|x2|y1|y2|cx|cy|r|rx|ry|width|height|viewBox|transform|points)=)(['"])(.*?)\2"""
+)
+_NUMBER = re.compile(r"-?\d*\.\d+")
+_DEFS = re.compile(r"<defs>(.*?)</defs>", re.S)
+_GLYPH = re.compile(r"""<path id=(['"])(?P<id>[^'"]+)\1 d=(['"])(?P<d>[^'"]*)\3\s*/>""")
+_HREF = re.compile(r"""((?:xlink:)?href=)(['"])#([^'"]+)\2""")
+
+
+def reduce_precision(svg: str, digits: int = 3) -> str:
+    """
+    Round the coordinates in geometry attributes to digits decimals.
+    """
+
+    def _round(matched: re.Match) -> str:
+        number = f"{float(matched.group(0)):.{digits}f}"
+        if "." in number:
+            number = number.rstrip("0").rstrip(".")
+        return "0" if number == "-0" else number
+
+    def _attribute(matched: re.Match) -> str:
+        return (
+            matched.group(1)
+            + matched.group(2)
+            + _NUMBER.sub(_round, matched.group(3))
+            + matched.group(2)
+        )
+
+    return _NUMBER_ATTRIBUTE.sub(_attribute, svg)
+
+
+def _glyph_id(d: str) -> str:
+    return "tz-" + sha1(d.encode()).hexdigest()[:10]
+
+
+def dedupe_glyphs(svg: str) -> tuple[str, dict]:
+    """
+    Rename every glyph in the defs after its outline, merging duplicates.
+
+    Returns the svg without its glyph definitions and a map from the new ids
+    to the outlines, so the caller decides where the definitions go.
+    """
+    glyphs = {}
+    renames = {}
+
+    def _collect(matched: re.Match) -> str:
+        new_id = _glyph_id(matched.group("d"))
+        renames[matched.group("id")] = new_id
+        glyphs[new_id] = matched.group("d")
+        return ""
+
+    def _defs(matched: re.Match) -> str:
+        rest = _GLYPH.sub(_collect, matched.group(1))
+        return f"<defs>{rest}</defs>" if rest.strip() else ""
+
+    svg = _DEFS.sub(_defs, svg)
+
+    def _href(matched: re.Match) -> str:
+        target = renames.get(matched.group(3), matched.group(3))
+        return f"{matched.group(1)}{matched.group(2)}#{target}{matched.group(2)}"
+
+    return _HREF.sub(_href, svg), glyphs
+
+
+def _glyph_defs(glyphs: dict) -> str:
+    return "<defs>" + "".join(f"<path id='{i}' d='{d}'/>" for i, d in glyphs.items()) + "</defs>"
+
+
+def _insert_defs(svg: str, defs: str) -> str:
+    """
+    Put defs right after the opening svg tag.
+    """
+    end = svg.find(">", svg.find("<svg")) + 1
+    return svg[:end] + defs + svg[end:]
+
+
+def optimize_svgs(svgs: list[str], digits: int = 3) -> tuple[str, list[str]]:
+    """
+    Optimize the svgs that end up on one page.
+
+    Coordinates are rounded and duplicate glyphs merged. Glyphs used by more
+    than one svg are hoisted into a single sprite, which the svgs reference
+    with <use>; the sprite is returned first and is empty if nothing is shared.
+    """
+    deduped = [dedupe_glyphs(reduce_precision(svg, digits)) for svg in svgs]
+
+    users = {}
+    for _, glyphs in deduped:
+        for glyph_id in glyphs:
+            users[glyph_id] = users.get(glyph_id, 0) + 1
+
+    shared = {}
+    optimized = []
+    for svg, glyphs in deduped:
+        own = {}
+        for glyph_id, d in glyphs.items():
+            if users[glyph_id] > 1:
+                shared[glyph_id] = d
+            else:
+                own[glyph_id] = d
+        optimized.append(_insert_defs(svg, _glyph_defs(own)) if own else svg)
+
+    sprite = ""
+    if shared:
+        sprite = (
+            "<svg xmlns='http://www.w3.org/2000/svg' width='0' height='0' aria-hidden='true'>"
+            + _glyph_defs(shared)
+            + "</svg>"
+        )
+    return sprite, optimized
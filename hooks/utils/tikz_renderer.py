@@ -1,10 +1,22 @@
 import os
+import re
+import atexit
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from functools import lru_cache
 from hashlib import sha256
+from typing import Optional
 
 from mkdocs.utils import log
 
+from .profiler import count, span
+from .svg_cache import SVGCache
 
-class TeXError(BaseException):
+
+class TeXError(Exception):
     pass
 
 
@@ -12,11 +24,239 @@ class TeXWriterConfig:
     def __init__(self) -> None:
         self.compiler = "xelatex"
         self.preamble = ""
+        # name of a precompiled format living in format_dir, see ensure_format
+        self.format = None
+        self.format_dir = None
+        # feed the tex file to a spare process which has the format loaded already
+        self.warm = False
+        # seconds a single xelatex or dvisvgm run may take, None for no limit
+        self.timeout = None
+        # threading.Event that aborts the running subprocess when set
+        self.cancel = None
+
+
+def _wait(
+    process: subprocess.Popen,
+    timeout: Optional[float] = None,
+    cancel: Optional[threading.Event] = None,
+) -> int:
+    """
+    Wait for process, killing it once timeout expires or cancel is set.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        try:
+            return process.wait(timeout=0.1 if cancel is not None else timeout)
+        except subprocess.TimeoutExpired:
+            pass
+        if cancel is not None and cancel.is_set():
+            process.kill()
+            process.wait()
+            raise TeXError(f"{process.args[0]} cancelled")
+        if deadline is not None and time.monotonic() >= deadline:
+            process.kill()
+            process.wait()
+            log.error(f"[tikzautomata] {process.args[0]} timed out after {timeout}s")
+            return -1
+
+
+@lru_cache(maxsize=None)
+def tex_version(program: str) -> str:
+    """
+    First line of `program --version`, empty if the program is unavailable.
+    """
+    try:
+        output = subprocess.run(
+            [program, "--version"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).stdout
+    except OSError:
+        return ""
+    return output.splitlines()[0] if output else ""
+
+
+# one format dump at a time, the threads of a process share format_dir
+_format_lock = threading.Lock()
+
+
+def ensure_format(
+    preamble: str,
+    format_dir: str,
+    compiler: str = "xelatex",
+    timeout: Optional[float] = None,
+) -> Optional[str]:
+    """
+    Dump preamble into a format file in format_dir, return the format name.
+
+    The name is keyed by the preamble and the TeX version, so a format is built
+    once and reused until either of them changes. Returns None if the format
+    cannot be built, in which case the preamble should be compiled as usual.
+    """
+    version = tex_version(compiler)
+    if not version:
+        return None
+    name = "automata-" + sha256(f"{preamble}\0{version}".encode()).hexdigest()[:16]
+    if os.path.exists(os.path.join(format_dir, f"{name}.fmt")):
+        return name
+    with _format_lock:
+        # dumped by another thread while this one waited
+        if os.path.exists(os.path.join(format_dir, f"{name}.fmt")):
+            return name
+        return _dump_format(preamble, format_dir, compiler, timeout, name)
+
+
+def _dump_format(
+    preamble: str, format_dir: str, compiler: str, timeout: Optional[float], name: str
+) -> Optional[str]:
+    log.info(f"[tikzautomata] dumping preamble into {name}.fmt")
+    with tempfile.TemporaryDirectory(prefix="tikzautomata-fmt-") as workdir:
+        with open(os.path.join(workdir, f"{name}.tex"), "w", encoding="utf-8") as f:
+            f.write(preamble + "\n\\dump\n")
+        process = subprocess.Popen(
+            [
+                compiler,
+                "-ini",
+                "-halt-on-error",
+                "-interaction=batchmode",
+                f"-jobname={name}",
+                f"&{compiler}",
+                f"{name}.tex",
+            ],
+            cwd=workdir,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        with span(f"{compiler} (format)", "subprocess"):
+            failed = _wait(process, timeout)
+        if failed or not os.path.exists(
+            os.path.join(workdir, f"{name}.fmt")
+        ):
+            log.warning("[tikzautomata] unable to dump the preamble, compiling without format")
+            return None
+        os.makedirs(format_dir, exist_ok=True)
+        # other processes may race here, the rename of a private copy keeps the file whole
+        fd, tmp = tempfile.mkstemp(dir=format_dir, prefix=f".{name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as dst, open(os.path.join(workdir, f"{name}.fmt"), "rb") as src:
+                shutil.copyfileobj(src, dst)
+            os.replace(tmp, os.path.join(format_dir, f"{name}.fmt"))
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            log.warning("[tikzautomata] unable to store the format, compiling without format")
+            return None
+    # formats of older preambles or TeX versions are never used again, copies
+    # still being written by other processes are left alone
+    for stale in os.listdir(format_dir):
+        if stale.startswith("automata-") and stale.endswith(".fmt") and stale != f"{name}.fmt":
+            try:
+                os.remove(os.path.join(format_dir, stale))
+            except OSError:
+                pass
+    return name
+
+
+class WarmTeX:
+    """
+    A spare TeX process that has loaded its format and waits on stdin for the
+    file to compile. Right after a compile a new spare is started, so that
+    loading the format overlaps with the rest of the work.
+
+    TeX only loads the format once it has read the first line of the terminal,
+    so the spare is sent a `\\relax` line right away and runs in scroll mode,
+    where running out of input prompts for the next line instead of aborting.
+    The compile line switches to nonstop mode before the \\input.
+    """
+
+    def __init__(self, cmd: list, env: dict) -> None:
+        self.cmd = cmd
+        self.env = env
+        self.workdir = tempfile.mkdtemp(prefix="tikzautomata-warm-")
+        self.process = None
+        # one spare serves one compile at a time
+        self.lock = threading.Lock()
+        self._spawn()
+
+    def _spawn(self) -> None:
+        try:
+            self.process = subprocess.Popen(
+                self.cmd + ["-interaction=scrollmode", "-jobname=warm"],
+                cwd=self.workdir,
+                env=self.env,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError:
+            self.process = None
+            return
+        try:
+            # the first line makes TeX load the format now, not at the compile
+            self.process.stdin.write(b"\\relax\n")
+            self.process.stdin.flush()
+        except OSError:
+            pass
+
+    def compile(
+        self,
+        tex_path: str,
+        xdv_path: str,
+        timeout: Optional[float] = None,
+        cancel: Optional[threading.Event] = None,
+    ) -> int:
+        with self.lock:
+            if self.process is None or self.process.poll() is not None:
+                self._spawn()
+                if self.process is None:
+                    return 127
+            process = self.process
+            try:
+                process.stdin.write(f"\\nonstopmode\\input{{{tex_path}}}\n".encode())
+                process.stdin.close()
+            except OSError:
+                pass
+            try:
+                code = _wait(process, timeout, cancel)
+                if code == 0:
+                    shutil.move(os.path.join(self.workdir, "warm.xdv"), xdv_path)
+            finally:
+                self._spawn()
+            return code
+
+    def close(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+_warm_processes = {}
+# guards _warm_processes, renders of several threads look up their spare in it
+_warm_lock = threading.Lock()
+
+
+@atexit.register
+def _close_warm_processes() -> None:
+    with _warm_lock:
+        for warm in _warm_processes.values():
+            warm.close()
+        _warm_processes.clear()
+
 
 
 class TeXWriter:
-    def __init__(self, config=TeXWriterConfig()) -> None:
-        self.config = config
+    def __init__(self, config=None, cwd: str = ".") -> None:
+        self.config = config if config is not None else TeXWriterConfig()
+        self.cwd = cwd
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cwd, name)
 
     def create_tex_file(self, content: str, tex_name: str) -> None:
         """
@@ -30,7 +270,7 @@ class TeXWriter:
         )
 
         try:
-            with open(f"{tex_name}.tex", "w", encoding="utf-8") as tex_file:
+            with open(self._path(f"{tex_name}.tex"), "w", encoding="utf-8") as tex_file:
                 tex_file.write(full_tex)
         except OSError:
             log.error("[tikzautomata] unable to create tex file!")
@@ -40,7 +280,7 @@ class TeXWriter:
         Generate svg from tex file
         """
         if self.config.compiler == "xelatex":
-            program = "xelatex -no-pdf"
+            program = ["xelatex", "-no-pdf"]
         else:
             raise NotImplementedError(
                 f"Compiler {self.config.compiler} is not implemented!"
@@ -49,104 +289,328 @@ class TeXWriter:
         log.info(f"rendering {tex_name}.svg")
 
         # use compiler to transform tex to pdf
-        tex2xdv_cmd = " ".join(
-            (
-                program,
-                "-halt-on-error",
-                "-interaction=batchmode",
-                f'"{tex_name}.tex"',
-                ">",
-                os.devnull,
-            )
-        )
-        log.debug(f"running {tex2xdv_cmd}")
-        if os.system(tex2xdv_cmd):
+        if self._compile(program, tex_name):
             log.error("LaTeX Error! Not a worry, it happens to the best of us.")
             raise TeXError("LaTeX Error! Look into log file for detail")
 
         # use dvisvgm to transform xdv to svg
-        xdv2svg_cmd = " ".join(
-            (
-                "dvisvgm",
-                f'"{tex_name}.xdv"',
-                "-n",
-                "-v 0",
-                f'-o "{tex_name}.svg"',
-                ">",
-                os.devnull,
-            )
-        )
-        log.debug(f"running {xdv2svg_cmd}")
-        if os.system(xdv2svg_cmd):
+        xdv2svg_cmd = [
+            "dvisvgm",
+            f"{tex_name}.xdv",
+            "-n",
+            "-v",
+            "0",
+            "-o",
+            f"{tex_name}.svg",
+        ]
+        log.debug(f"running {' '.join(xdv2svg_cmd)}")
+        if self._run(xdv2svg_cmd):
             log.error("dvisvgm Error!")
             raise TeXError("dvisvgm Error!")
 
         # clean up
         for ext in (".log", ".aux", ".xdv", ".tex"):
             try:
-                os.remove(tex_name + ext)
+                os.remove(self._path(tex_name + ext))
             except FileNotFoundError:
                 pass
 
+    def create_svgs_from_tex(self, tex_name: str) -> list[str]:
+        """
+        Generate one svg per page from a multi-page tex file, in page order
+        """
+        if self.config.compiler == "xelatex":
+            program = ["xelatex", "-no-pdf"]
+        else:
+            raise NotImplementedError(
+                f"Compiler {self.config.compiler} is not implemented!"
+            )
 
-class TikZAutomataRenderer:
-    def __init__(self, options: str, contents: str) -> None:
-        self.options = options
-        self.contents = contents
+        log.info(f"rendering {tex_name}-*.svg")
 
-    def write_to_svg(self, cachefile: bool) -> str:
-        filename = sha256(
-            self.contents.encode() + (self.options.encode() if self.options else b"")
-        ).hexdigest()
+        if self._compile(program, tex_name):
+            raise TeXError("LaTeX Error! Look into log file for detail")
 
-        if cachefile:
-            try:
-                os.chdir("cache")
-            except OSError:
-                log.error("[tikzautomata] cache directory not found!")
+        xdv2svg_cmd = [
+            "dvisvgm",
+            f"{tex_name}.xdv",
+            "--page=1-",
+            "-n",
+            "-v",
+            "0",
+            "-o",
+            f"{tex_name}-%p.svg",
+        ]
+        log.debug(f"running {' '.join(xdv2svg_cmd)}")
+        if self._run(xdv2svg_cmd):
+            raise TeXError("dvisvgm Error!")
+
+        # dvisvgm may zero-pad %p, so sort by the parsed page number
+        pages = {}
+        for name in os.listdir(self.cwd):
+            matched = re.fullmatch(rf"{re.escape(tex_name)}-(\d+)\.svg", name)
+            if matched:
+                pages[int(matched.group(1))] = self._path(name)
+        return [pages[i] for i in sorted(pages)]
+
+    def _compile(self, program: list, tex_name: str) -> int:
+        """
+        Compile tex_name into an xdv file, starting from the format if there is one.
+        """
+        env = None
+        if self.config.format:
+            program = program + [f"-fmt={self.config.format}"]
+            # the trailing separator keeps the default search path
+            env = dict(os.environ, TEXFORMATS=self.config.format_dir + os.pathsep)
+
+        if self.config.format and self.config.warm:
+            cmd = program + ["-halt-on-error"]
+            key = (tuple(cmd), self.config.format_dir)
+            with _warm_lock:
+                warm = _warm_processes.get(key)
+                if warm is None:
+                    if not _warm_processes:
+                        import multiprocessing.util
+
+                        # pool workers leave through os._exit, which skips atexit;
+                        # registered here since forked workers drop inherited ones
+                        multiprocessing.util.Finalize(
+                            None, _close_warm_processes, exitpriority=10
+                        )
+                    warm = _warm_processes[key] = WarmTeX(cmd, env)
+            log.debug(f"feeding {tex_name}.tex to a warm {program[0]}")
+            with span(f"{program[0]} (warm)", "subprocess"):
+                return warm.compile(
+                    os.path.abspath(self._path(f"{tex_name}.tex")).replace(os.sep, "/"),
+                    self._path(f"{tex_name}.xdv"),
+                    self.config.timeout,
+                    self.config.cancel,
+                )
+
+        tex2xdv_cmd = program + [
+            "-halt-on-error",
+            "-interaction=batchmode",
+            f"{tex_name}.tex",
+        ]
+        log.debug(f"running {' '.join(tex2xdv_cmd)}")
+        return self._run(tex2xdv_cmd, env)
+
+    def _run(self, cmd: list, env: Optional[dict] = None) -> int:
+        """
+        Run cmd inside the working directory of this writer, return its exit code.
+        """
+        try:
+            process = subprocess.Popen(
+                cmd,
+                cwd=self.cwd,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except FileNotFoundError:
+            log.error(f"[tikzautomata] {cmd[0]} not found!")
+            return 127
+        with span(cmd[0], "subprocess"):
+            return _wait(process, self.config.timeout, self.config.cancel)
+
+
+def format_dir(cache_dir: str) -> str:
+    """
+    Where the renderers of cache_dir keep their formats.
+    """
+    return os.path.join(os.path.abspath(cache_dir), "formats")
 
-        if cachefile and os.path.exists(f"{filename}.svg"):
-            log.debug("[tikzautomata] load from existing file...")
-            with open(f"{filename}.svg", "r", encoding="utf-8") as f:
-                svg_str = f.read(None)
-            os.chdir("..")
-            return svg_str
 
-        writer = TeXWriter()
-        writer.config.preamble = r"""
+class TikZAutomataRenderer:
+    PREAMBLE = r"""
 \documentclass[dvisvgm]{standalone}
 \usepackage{tikz}
 
 \usetikzlibrary {arrows.meta,automata,positioning,shapes.geometric}
         """
-        begin_command = (
-            r"\begin{tikzpicture}[%s]" % self.options
-            if self.options
-            else r"\begin{tikzpicture}[->,>={Stealth[round]},shorten >=1pt,auto,node distance=2cm,on grid,semithick,inner sep=2pt,bend angle=50,initial text=]"
+    DEFAULT_OPTIONS = r"->,>={Stealth[round]},shorten >=1pt,auto,node distance=2cm,on grid,semithick,inner sep=2pt,bend angle=50,initial text="
+    # bump when the way svgs are produced changes in a way the key cannot see
+    RENDER_VERSION = "1"
+
+    def __init__(
+        self,
+        options: str,
+        contents: str,
+        cache_dir: str = "cache",
+        precompile: bool = False,
+        warm: bool = False,
+        timeout: Optional[float] = None,
+    ) -> None:
+        self.options = options
+        self.contents = contents
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.cache = SVGCache.open(self.cache_dir)
+        self.precompile = precompile
+        self.warm = warm
+        self.timeout = timeout
+        # set from another thread to abort a render in progress
+        self.cancel = threading.Event()
+
+    @property
+    def format_dir(self) -> str:
+        return format_dir(self.cache_dir)
+
+    def writer_config(self, extra_preamble: str = "") -> TeXWriterConfig:
+        """
+        Writer config for this picture, using the precompiled preamble if enabled.
+        """
+        config = TeXWriterConfig()
+        config.timeout = self.timeout
+        config.cancel = self.cancel
+        fmt = (
+            ensure_format(self.PREAMBLE, self.format_dir, config.compiler, self.timeout)
+            if self.precompile
+            else None
         )
-        writer.create_tex_file(
-            "\n".join(
-                (
-                    begin_command,
-                    self.contents.strip(),
-                    "\\end{tikzpicture}\n",
-                )
-            ),
-            filename,
+        if fmt:
+            config.format = fmt
+            config.format_dir = self.format_dir
+            config.warm = self.warm
+            config.preamble = extra_preamble
+        else:
+            config.preamble = self.PREAMBLE + extra_preamble
+        return config
+
+    @property
+    def filename(self) -> str:
+        """
+        Cache key covering every input of the render: the picture, the
+        preamble and the versions of the whole toolchain.
+        """
+        compiler = TeXWriterConfig().compiler
+        return SVGCache.key(
+            self.RENDER_VERSION,
+            compiler,
+            tex_version(compiler),
+            tex_version("dvisvgm"),
+            self.PREAMBLE,
+            self.tikzpicture(),
         )
 
-        writer.create_svg_from_tex(filename)
+    def is_cached(self) -> bool:
+        return self.cache.contains(self.filename)
 
-        with open(f"{filename}.svg", "r", encoding="utf-8") as f:
-            svg_str = f.read(None)
+    def tikzpicture(self) -> str:
+        begin_command = r"\begin{tikzpicture}[%s]" % (
+            self.options if self.options else self.DEFAULT_OPTIONS
+        )
+        return "\n".join(
+            (
+                begin_command,
+                self.contents.strip(),
+                "\\end{tikzpicture}\n",
+            )
+        )
 
-        # clean up
-        if not cachefile:
-            try:
-                os.remove(filename + ".svg")
-            except FileNotFoundError:
-                pass
+    def render(self) -> str:
+        """
+        Compile the picture in a private temporary directory and return the svg.
+
+        Nothing here touches the working directory of the process, so several
+        renders may run side by side.
+        """
+        filename = self.filename
+        with tempfile.TemporaryDirectory(prefix="tikzautomata-") as workdir:
+            writer = TeXWriter(self.writer_config(), cwd=workdir)
+            writer.create_tex_file(self.tikzpicture(), filename)
+
+            writer.create_svg_from_tex(filename)
+
+            with open(os.path.join(workdir, f"{filename}.svg"), "r", encoding="utf-8") as f:
+                return f.read(None)
+
+    def save_to_cache(self, svg_str: str) -> None:
+        self.cache.put(self.filename, svg_str)
+
+    def write_to_svg(self, cachefile: bool) -> str:
+        if cachefile:
+            svg_str = self.cache.get(self.filename)
+            if svg_str is not None:
+                log.debug("[tikzautomata] load from existing file...")
+                count("tikz cache hit")
+                return svg_str
+            count("tikz cache miss")
 
-        os.chdir("..")
+        svg_str = self.render()
+
+        if cachefile:
+            self.save_to_cache(svg_str)
 
         return svg_str
+
+
+def render_batch(renderers: list[TikZAutomataRenderer]) -> list[Optional[str]]:
+    """
+    Render several pictures with a single TeX run.
+
+    All pictures go into one multi-page standalone document, which is
+    compiled once and split into one svg per page by dvisvgm. If the batch
+    fails, every picture is rendered on its own, so that a single broken
+    picture only costs itself; its entry in the result is None.
+    """
+    if len(renderers) > 1:
+        try:
+            with tempfile.TemporaryDirectory(prefix="tikzautomata-") as workdir:
+                writer = TeXWriter(
+                    renderers[0].writer_config("\n\\standaloneenv{tikzpicture}\n"),
+                    cwd=workdir,
+                )
+                writer.create_tex_file(
+                    "\n".join(renderer.tikzpicture() for renderer in renderers),
+                    "batch",
+                )
+                pages = writer.create_svgs_from_tex("batch")
+                if len(pages) != len(renderers):
+                    raise TeXError(
+                        f"expected {len(renderers)} pages, got {len(pages)}"
+                    )
+                svgs = []
+                for page in pages:
+                    with open(page, "r", encoding="utf-8") as f:
+                        svgs.append(f.read(None))
+                return svgs
+        except TeXError as e:
+            log.warning(
+                f"[tikzautomata] batch of {len(renderers)} failed ({e}), rendering one by one"
+            )
+
+    svgs = []
+    for renderer in renderers:
+        try:
+            svgs.append(renderer.render())
+        except TeXError:
+            svgs.append(None)
+    return svgs
+
+
+def render_to_cache(
+    jobs: list[tuple[str, str]],
+    cache_dir: str,
+    precompile: bool = False,
+    warm: bool = False,
+    timeout: Optional[float] = None,
+) -> list[str]:
+    """
+    Worker entry for the pre-render pool: render a batch of (options, contents)
+    pictures into cache_dir, return the names of those that succeeded.
+    """
+    renderers = [
+        TikZAutomataRenderer(options, contents, cache_dir, precompile, warm, timeout)
+        for options, contents in jobs
+    ]
+    renderers = [renderer for renderer in renderers if not renderer.is_cached()]
+    if not renderers:
+        return []
+
+    rendered = []
+    for renderer, svg_str in zip(renderers, render_batch(renderers)):
+        if svg_str is not None:
+            renderer.save_to_cache(svg_str)
+            rendered.append(renderer.filename)
+    return rendered
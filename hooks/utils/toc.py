@@ -1,147 +1,628 @@
 import os
 import re
+import json
 import time
-from git import Repo, Git
+import tempfile
+import threading
+from hashlib import sha1, sha256
+from typing import TYPE_CHECKING, Optional
+
+from mkdocs.utils import log
+
+from .prefetch import Prefetcher, wait
+from .profiler import span
+
+if TYPE_CHECKING:
+    # GitPython is slow to import, it is only loaded once a TOC asks for git
+    from git import Git
+
+
+# fenced code, removed first and counted as code lines
+_FENCE = re.compile(r"```[^\n].*?```", re.S)
+# markup that does not count as words, removed one after the other in this
+# order, since every removal can complete or break the matches of the next
+_COMMENT = re.compile(r"<!--.*?-->", re.S)
+_REFERENCE = re.compile(r"^\[[^]]*\][^(].*", re.M)
+_ATTRIBUTES = re.compile(r"\{#.*\}")
+_IMAGE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+# only the text of links is kept
+_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+_TAG = re.compile(r"</?[^>]*>")
+_PUNCTUATION = re.compile(r"[#*`~\-–^=<>+|/:]+")
+_CITATION = re.compile(r"\[[0-9]*\]")
+_NUMBERING = re.compile(r"[0-9]*\.")
+# a chinese character or a run of ascii letters and digits
+_WORD = re.compile(r"[\u4e00-\u9fa5]|[a-zA-Z0-9]+")
 
 
 def _words_count(markdown: str) -> tuple[int, int, int]:
-    chinese, english, codes = _split_markdown(markdown)
-    code_lines = 0
-    words = len(chinese) + len(english.split())
-    for code in codes:
-        code_lines += len(code.splitlines()) - 2
+    text, code_lines = _clean_markdown(markdown)
+    words = len(_WORD.findall(text))
     read_time = round(words / 300 + code_lines / 80)
     return words, code_lines, read_time
 
 
-def _split_markdown(markdown: str) -> tuple[str, str, list]:
-    markdown, codes = _clean_markdown(markdown)
-    chinese = "".join(re.findall(r"[\u4e00-\u9fa5]", markdown))
-    english = " ".join(re.findall(r"[a-zA-Z0-9]*?(?![a-zA-Z0-9])", markdown))
-    return chinese, english, codes
+def _clean_markdown(markdown: str) -> tuple[str, int]:
+    """
+    Strip the markdown down to the text that counts as words, and count the
+    lines of fenced code.
+
+    This stays a chain of about ten regex passes rather than a single scan: a
+    tokenizer matching all the markup at once counts differently wherever one
+    removal completes or breaks a match of a later one. Each removal is
+    skipped when the text lacks a string all its matches contain. Whitespace
+    is left as it is, no pattern below tells spaces, tabs and newlines apart
+    where it matters.
+    """
+    parts, code_lines, last = [], 0, 0
+    for code in _FENCE.finditer(markdown):
+        parts.append(markdown[last : code.start()])
+        code_lines += len(code.group(0).splitlines()) - 2
+        last = code.end()
+    parts.append(markdown[last:])
+    text = "".join(parts)
+    if "<!--" in text:
+        text = _COMMENT.sub("", text)
+    if "[" in text:
+        text = _REFERENCE.sub("", text)
+    if "{#" in text:
+        text = _ATTRIBUTES.sub("", text)
+    if "](" in text:
+        text = _LINK.sub(r"\1", _IMAGE.sub("", text))
+    if "<" in text:
+        text = _TAG.sub("", text)
+    # punctuation goes first, "[1-2]" is a citation once the dash is gone
+    text = _NUMBERING.sub("", _CITATION.sub("", _PUNCTUATION.sub("", text)))
+    return text, code_lines
+
 
+def _blob_sha(data: bytes) -> str:
+    """
+    The sha git gives a blob of these bytes.
+    """
+    return sha1(b"blob %d\0" % len(data) + data).hexdigest()
 
-def _clean_markdown(markdown: str) -> tuple[str, list]:
-    codes = re.findall(r"```[^\n].*?```", markdown, re.S)
-    markdown = re.sub(r"```[^\n].*?```", "", markdown, flags=re.DOTALL | re.MULTILINE)
-    markdown = re.sub(r"<!--.*?-->", "", markdown, flags=re.DOTALL | re.MULTILINE)
-    markdown = markdown.replace("\t", "    ")
-    markdown = re.sub(r"[ ]{2,}", "    ", markdown)
-    markdown = re.sub(r"^\[[^]]*\][^(].*", "", markdown, flags=re.MULTILINE)
-    markdown = re.sub(r"{#.*}", "", markdown)
-    markdown = markdown.replace("\n", " ")
-    markdown = re.sub(r"!\[[^\]]*\]\([^)]*\)", "", markdown)
-    markdown = re.sub(r"\[([^\]]*)\]\([^)]*\)", r"\1", markdown)
-    markdown = re.sub(r"</?[^>]*>", "", markdown)
-    markdown = re.sub(r"[#*`~\-–^=<>+|/:]", "", markdown)
-    markdown = re.sub(r"\[[0-9]*\]", "", markdown)
-    markdown = re.sub(r"[0-9#]*\.", "", markdown)
-    return markdown, codes
+
+def _count_file(path: str) -> tuple[str, tuple[int, int, int]]:
+    """
+    The blob sha and the statistics of a file, run in the prefetch processes.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    # count what reading in text mode gives
+    markdown = data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+    return _blob_sha(data), _words_count(markdown)
+
+
+class TreeIndex:
+    """
+    Statistics of the markdown files of the docs tree, summed up per directory.
+
+    Every file is read and counted once per build, and the totals of a
+    directory are built from those of its subdirectories, so TOC entries that
+    list overlapping subtrees do not count the same files again.
+
+    With a cache_dir, the statistics of a file are also kept across builds
+    under the git blob sha of its contents. For tracked files without local
+    changes that sha comes from `git ls-files -s`, so they are not even read
+    on a hit; other files are hashed the same way.
+    """
+
+    CACHE_FILE = "statistics.json"
+    # bump whenever the counting changes
+    VERSION = 2
+
+    def __init__(self, cache_dir: Optional[str] = None) -> None:
+        # file path -> (words, code lines, read time)
+        self.files = {}
+        # directory path -> (words, code lines, read time)
+        self.directories = {}
+        # (directory path, ignore rules) -> latest update time
+        self.update_times = {}
+        # repository root -> {real file path: blob sha} of the unchanged files
+        self.blobs = {}
+        # working dir of a repository -> its root, as git reports it
+        self.roots = {}
+        self.cache_file = os.path.join(cache_dir, self.CACHE_FILE) if cache_dir else None
+        # blob sha -> (words, code lines, read time)
+        self.cached = self._load()
+        # blob shas looked up during this build, everything else is dropped on save
+        self.used = set()
+        # file path -> future of its _count_file in the prefetch processes
+        self.pending = {}
+
+    def _load(self) -> dict:
+        if not self.cache_file:
+            return {}
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if cached.get("version") != self.VERSION:
+            return {}
+        return cached.get("entries", {})
+
+    def save(self) -> None:
+        if not self.cache_file:
+            return
+        entries = {key: self.cached[key] for key in self.used if key in self.cached}
+        cache_dir = os.path.dirname(self.cache_file)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"version": self.VERSION, "entries": entries}, f)
+            os.replace(tmp, self.cache_file)
+        except OSError:
+            log.error(f"[toc] unable to write {self.cache_file}")
+
+    def _tracked_blob(self, path: str) -> Optional[str]:
+        """
+        The blob sha of path if git already knows its contents.
+        """
+        if not self.cache_file:
+            return None
+        from git.exc import GitCommandError, InvalidGitRepositoryError, NoSuchPathError
+
+        path = os.path.realpath(path)
+        try:
+            repo = _get_repo(path)
+            root = self.roots.get(repo.working_dir)
+            if root is None:
+                with span("git rev-parse", "subprocess"):
+                    root = self.roots[repo.working_dir] = repo.rev_parse("--show-toplevel")
+        except (GitCommandError, InvalidGitRepositoryError, NoSuchPathError):
+            return None
+        if root not in self.blobs:
+            with span("git ls-files", "subprocess"):
+                modified = set(repo.ls_files("-m", "-z").split("\0"))
+                staged = repo.ls_files("-s", "-z")
+            blobs = {}
+            for entry in staged.split("\0"):
+                if not entry:
+                    continue
+                info, _, name = entry.partition("\t")
+                _, sha, stage = info.split()
+                if stage == "0" and name not in modified:
+                    blobs[os.path.join(root, name)] = sha
+            self.blobs[root] = blobs
+        return self.blobs[root].get(path)
+
+    @staticmethod
+    def _scan(path: str) -> tuple[list, list, int]:
+        """
+        The markdown files and subdirectories of path, and the number of files
+        in it, the way os.walk sees them.
+        """
+        markdowns, subdirs, count = [], [], 0
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return markdowns, subdirs, count
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
+                continue
+            count += 1
+            if entry.name.endswith(".md"):
+                markdowns.append(entry.path)
+        return markdowns, subdirs, count
+
+    def file_statistics(self, path: str) -> tuple[int, int, int]:
+        if path not in self.files:
+            key = self._tracked_blob(path)
+            if key is None or key not in self.cached:
+                counted = wait(self.pending.pop(path, None)) or _count_file(path)
+                # a tracked file stays under the sha git knows it by
+                key = key or counted[0]
+                self.cached.setdefault(key, counted[1])
+            self.used.add(key)
+            self.files[path] = tuple(self.cached[key])
+        return self.files[path]
+
+    def markdown_files(self, path: str):
+        """
+        Every markdown file below the directory path.
+        """
+        markdowns, subdirs, _ = self._scan(path)
+        yield from markdowns
+        for subdir in subdirs:
+            yield from self.markdown_files(subdir)
+
+    def prefetch(self, prefetcher: Prefetcher, path: str) -> None:
+        """
+        Count the uncached markdown files below path in the prefetch processes.
+        """
+        if os.path.isdir(path):
+            markdowns = self.markdown_files(path)
+        elif os.path.exists(path + ".md"):
+            markdowns = [path + ".md"]
+        else:
+            return
+        for file in markdowns:
+            if file in self.files or file in self.pending:
+                continue
+            if self._tracked_blob(file) in self.cached:
+                continue
+            self.pending[file] = prefetcher.process(_count_file, file)
+
+    def directory_statistics(self, path: str) -> tuple[int, int, int]:
+        if path not in self.directories:
+            words, codes, read_time = 0, 0, 0
+            markdowns, subdirs, _ = self._scan(path)
+            for file in markdowns:
+                w, c, r = self.file_statistics(file)
+                words += w
+                codes += c
+                read_time += r
+            for subdir in subdirs:
+                w, c, r = self.directory_statistics(subdir)
+                words += w
+                codes += c
+                read_time += r
+            self.directories[path] = (words, codes, read_time)
+        return self.directories[path]
+
+    def directory_update_time(self, path: str, ignore_commits: list) -> int:
+        key = (path, repr(ignore_commits))
+        if key not in self.update_times:
+            update_time = 0
+            markdowns, subdirs, count = self._scan(path)
+            for file in markdowns:
+                # an index.md only counts if it is alone in its directory
+                if count != 1 and os.path.basename(file) == "index.md":
+                    continue
+                update_time = max(update_time, get_latest_commit_timestamp(file, ignore_commits))
+            for subdir in subdirs:
+                update_time = max(update_time, self.directory_update_time(subdir, ignore_commits))
+            self.update_times[key] = update_time
+        return self.update_times[key]
+
+
+_tree_index = TreeIndex()
+
+
+def reset_tree_index(cache_dir: Optional[str] = None) -> None:
+    """
+    Forget the counted files, e.g. before a rebuild that may follow edits.
+
+    Statistics of unchanged files are kept in cache_dir across builds, if given.
+    """
+    global _tree_index
+    _tree_index = TreeIndex(cache_dir)
+
+
+def save_tree_index() -> None:
+    _tree_index.save()
+
+
+def prefetch_toc(prefetcher: Prefetcher, links: list, base: str, ignore_commits: list) -> None:
+    """
+    Start the work the TOC links of a page will need: the git history index in
+    a thread and the statistics of their files in processes.
+    """
+    prefetcher.thread(_get_index, os.path.realpath(base), ignore_commits)
+    for link in links:
+        _tree_index.prefetch(prefetcher, os.path.normpath(os.path.join(base, link)))
 
 
 def get_statistics(path, base):
-    words, codes, read_time = 0, 0, 0
-    path = os.path.join(base, path)
+    path = os.path.normpath(os.path.join(base, path))
     if os.path.exists(path):
-        for root, dirs, files in os.walk(path):
-            for file in files:
-                if file.endswith(".md"):
-                    with open(os.path.join(root, file), "r", encoding="utf-8") as f:
-                        markdown = f.read()
-                        w, c, r = _words_count(markdown)
-                        words += w
-                        codes += c
-                        read_time += r
-    else:
-        if path.endswith("/"):
-            file = path[:-1] + ".md"
-        else:
-            file = path + ".md"
-        if os.path.exists(file):
-            with open(file, "r", encoding="utf-8") as f:
-                markdown = f.read()
-                words, codes, read_time = _words_count(markdown)
-    return words, codes, read_time
+        return _tree_index.directory_statistics(path)
+    file = path + ".md"
+    if os.path.exists(file):
+        return _tree_index.file_statistics(file)
+    return 0, 0, 0
 
 
 _repo_cache = {}
 
 
-def _get_repo(path: str) -> Git:
+def _get_repo(path: str) -> "Git":
     """
     Get the git repository of the path.
     """
+    from git import Repo
 
     if not os.path.isdir(path):
         path = os.path.dirname(path)
 
     if path not in _repo_cache:
-        _repo_cache[path] = Repo(path, search_parent_directories=True).git
+        with span("git repo", "subprocess"):
+            _repo_cache[path] = Repo(path, search_parent_directories=True).git
 
     return _repo_cache[path]
 
 
-def _check_ignore(sha: str, path: str, ignore_commits: list[str]) -> bool:
+class TimestampIndex:
     """
-    Check if the commit should be ignored.
+    Latest commit timestamp of every path of a repository.
+
+    Built from a single `git log --name-status` over the whole history, newest
+    commit first. Renames are followed backwards through an alias map, so the
+    commits of a file before it was renamed count for its current name, like
+    `git log --follow` does. The ignore rules are turned into sets of sha
+    prefixes grouped by prefix length, which makes checking a commit a few
+    set lookups instead of a scan over every rule.
+
+    With a cache_dir, the index is saved there stamped with HEAD and a hash of
+    the ignore rules. The next build only reads the commits since that HEAD,
+    and starts over if the history was rewritten or the rules changed.
     """
-    for ignore in ignore_commits:
-        if isinstance(ignore, str):
-            if sha.startswith(ignore):
+
+    CACHE_FILE = "timestamps.json"
+    VERSION = 1
+
+    def __init__(self, repo: "Git", ignore_commits: list, cache_dir: Optional[str] = None) -> None:
+        with span("git rev-parse", "subprocess"):
+            self.root = repo.rev_parse("--show-toplevel")
+        # prefix length -> prefixes ignored for every path
+        self.ignored = {}
+        # prefix length -> prefix -> path suffixes it is ignored for
+        self.ignored_for = {}
+        for ignore in ignore_commits:
+            if isinstance(ignore, str):
+                self.ignored.setdefault(len(ignore), set()).add(ignore)
+            else:  # dict
+                filename = list(ignore.keys())[0]
+                sha = ignore[filename]
+                self.ignored_for.setdefault(len(sha), {}).setdefault(sha, []).append(filename)
+        self.rules = sha256(json.dumps(ignore_commits, sort_keys=True).encode()).hexdigest()
+        self.cache_file = os.path.join(cache_dir, self.CACHE_FILE) if cache_dir else None
+
+        from git.exc import GitCommandError
+
+        try:
+            with span("git rev-parse", "subprocess"):
+                head = repo.rev_parse("HEAD")
+        except GitCommandError:
+            # no commit yet
+            head = None
+        cached = self._load()
+        if head is None:
+            self.timestamps = {}
+        elif cached and cached["head"] == head:
+            self.timestamps = cached["timestamps"]
+        elif cached and self._is_ancestor(repo, cached["head"]):
+            self.timestamps = self._update(repo, cached["head"], cached["timestamps"])
+            self._save(head)
+        else:
+            self.timestamps, _ = self._read_log(repo)
+            self._save(head)
+
+    def _is_ignored(self, sha: str, path: str) -> bool:
+        for length, prefixes in self.ignored.items():
+            if sha[:length] in prefixes:
                 return True
-        else:  # dict
-            filename = list(ignore.keys())[0]
-            if path.endswith(filename):
-                if sha.startswith(ignore[filename]):
-                    return True
-    return False
+        for length, prefixes in self.ignored_for.items():
+            filenames = prefixes.get(sha[:length])
+            if filenames and any(path.endswith(filename) for filename in filenames):
+                return True
+        return False
+
+    @staticmethod
+    def _is_ancestor(repo: "Git", sha: str) -> bool:
+        from git.exc import GitCommandError
+
+        try:
+            with span("git merge-base", "subprocess"):
+                repo.merge_base("--is-ancestor", sha, "HEAD")
+        except GitCommandError:
+            return False
+        return True
+
+    def _read_log(self, repo: "Git", since: Optional[str] = None) -> tuple[dict, dict]:
+        """
+        Timestamps of the paths touched since the given commit (or ever), and
+        the current name of every path renamed in those commits.
+        """
+        command = [
+            "git",
+            "-c",
+            "core.quotepath=off",
+            "log",
+            "--name-status",
+            "-M",
+            "--format=%x00%H %at",
+        ]
+        if since:
+            command.append(f"{since}..HEAD")
+        with span("git log", "subprocess", since=since or ""):
+            log = repo.execute(command)
+        timestamps = {}
+        # name of a path in older commits -> its current name
+        aliases = {}
+        for commit in log.split("\0")[1:]:
+            header, _, changes = commit.partition("\n")
+            sha, timestamp = header.split()
+            for change in changes.splitlines():
+                if not change:
+                    continue
+                status, *paths = change.split("\t")
+                if status.startswith("R"):
+                    old, new = paths
+                    current = aliases.get(new, new)
+                    aliases[old] = current
+                else:
+                    current = aliases.get(paths[-1], paths[-1])
+                if current in timestamps:
+                    continue
+                if self._is_ignored(sha, os.path.join(self.root, current)):
+                    continue
+                timestamps[current] = int(timestamp)
+        return timestamps, aliases
+
+    def _update(self, repo: "Git", since: str, cached: dict) -> dict:
+        timestamps, aliases = self._read_log(repo, since)
+        log.debug(f"[toc] {len(timestamps)} paths changed since {since[:12]}")
+        for path, timestamp in cached.items():
+            # older history of a renamed file counts for its new name
+            current = aliases.get(path, path)
+            if current not in timestamps:
+                timestamps[current] = max(timestamp, timestamps.get(current, 0))
+        return timestamps
+
+    def _load(self) -> Optional[dict]:
+        if not self.cache_file:
+            return None
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get("version") != self.VERSION or cached.get("rules") != self.rules:
+            return None
+        return cached
+
+    def _save(self, head: str) -> None:
+        if not self.cache_file:
+            return
+        cache_dir = os.path.dirname(self.cache_file)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "version": self.VERSION,
+                        "head": head,
+                        "rules": self.rules,
+                        "timestamps": self.timestamps,
+                    },
+                    f,
+                    ensure_ascii=False,
+                )
+            os.replace(tmp, self.cache_file)
+        except OSError:
+            log.error(f"[toc] unable to write {self.cache_file}")
+
+    def get(self, path: str):
+        return self.timestamps.get(os.path.relpath(path, self.root).replace(os.sep, "/"))
+
+
+_index_cache = {}
+_index_cache_dir = None
+
+
+# held while building an index, which a prefetch thread may be doing already
+_index_lock = threading.Lock()
+
+
+def _get_index(path: str, ignore_commits: list) -> TimestampIndex:
+    repo = _get_repo(path)
+    key = (repo.working_dir, repr(ignore_commits))
+    with _index_lock:
+        if key not in _index_cache:
+            _index_cache[key] = TimestampIndex(repo, ignore_commits, _index_cache_dir)
+    return _index_cache[key]
+
+
+def reset_timestamp_index(cache_dir: Optional[str] = None) -> None:
+    """
+    Forget the indexed history, e.g. before a rebuild that may follow new commits.
+
+    The next index is kept up to date in cache_dir, if given.
+    """
+    global _index_cache_dir
+    # imported here rather than racing for it from the prefetch threads, which
+    # can see GitPython and gitdb half initialized
+    import git  # noqa: F401
+
+    _index_cache.clear()
+    _index_cache_dir = cache_dir
 
 
 def get_latest_commit_timestamp(path: str, ignore_commits: list[str]) -> int:
     """
     Get the timestamp of the latest commit of the path.
 
-    If no commit is found, return the current timestamp.
+    If no commit is found, return the time the file was last modified, so
+    that TOCs linking a draft still match their cached update times.
     """
 
     realpath = os.path.realpath(path)
-    repo = _get_repo(realpath)
-
-    if ignore_commits:
-        commits = repo.log(realpath, format="%H %at", follow=True)
-        commit_timestamp = ""
-        for commit in commits.splitlines():
-            sha, timestamp = commit.split()
-            if _check_ignore(sha, path, ignore_commits):
-                continue
-            commit_timestamp = timestamp
-            break
-    else:
-        commit_timestamp = repo.log(realpath, format="%at", n=1)
+    commit_timestamp = _get_index(realpath, ignore_commits).get(realpath)
 
-    if commit_timestamp == "":
-        commit_timestamp = time.time()
+    if commit_timestamp is None:
+        try:
+            commit_timestamp = os.path.getmtime(realpath)
+        except OSError:
+            commit_timestamp = time.time()
 
     return int(commit_timestamp)
 
 
 def get_update_time(path, base, ignore_commits):
-    path = os.path.join(base, path)
+    path = os.path.normpath(os.path.join(base, path))
     if os.path.exists(path):
-        time = 0
-        for root, dirs, files in os.walk(path):
-            for file in files:
-                if len(files) != 1 and file == "index.md":
-                    continue
-                if file.endswith(".md"):
-                    file = os.path.join(root, file)
-                    time = max(time, get_latest_commit_timestamp(file, ignore_commits))
-        return time
-    else:
-        if path.endswith("/"):
-            file = path[:-1] + ".md"
-        else:
-            file = path + ".md"
-        if os.path.exists(file):
-            return get_latest_commit_timestamp(file, ignore_commits)
+        return _tree_index.directory_update_time(path, ignore_commits)
+    file = path + ".md"
+    if os.path.exists(file):
+        return get_latest_commit_timestamp(file, ignore_commits)
     return 0
+
+
+def _stat(path: str) -> Optional[tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _digest(path: str) -> Optional[str]:
+    """
+    What a dependency holds: the blob sha of a file, a hash of the entries of
+    a directory, None if it is missing.
+    """
+    if os.path.isdir(path):
+        try:
+            return sha1("\0".join(sorted(os.listdir(path))).encode()).hexdigest()
+        except OSError:
+            return None
+    sha = _tree_index._tracked_blob(path)
+    if sha is not None:
+        return sha
+    try:
+        with open(path, "rb") as f:
+            return _blob_sha(f.read())
+    except OSError:
+        return None
+
+
+def get_dependencies(path, base) -> list[list]:
+    """
+    The [path, stat, digest] of every file and directory the statistics and
+    update time of a TOC link are read from. The entries of a directory count,
+    and a missing file is listed too, so creating it shows up.
+    """
+    path = os.path.normpath(os.path.join(base, path))
+    paths = [path]
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            paths.extend(os.path.join(root, name) for name in dirs)
+            paths.extend(os.path.join(root, name) for name in files if name.endswith(".md"))
+    elif not os.path.exists(path):
+        paths.append(path + ".md")
+    return [[path, _stat(path), _digest(path)] for path in paths]
+
+
+def dependencies_changed(dependencies: list[list]) -> bool:
+    """
+    Whether any dependency holds something else now. Only those whose stat
+    changed are read, a fresh checkout with new mtimes still matches.
+    """
+    for path, stat, digest in dependencies:
+        current = _stat(path)
+        if current is not None and stat is not None and list(current) == list(stat):
+            continue
+        if (current is None) != (stat is None) or _digest(path) != digest:
+            return True
+    return False
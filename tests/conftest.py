@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the hooks import their helpers as `utils.*`, like MkDocs loads them
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "hooks"))
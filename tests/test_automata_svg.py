@@ -0,0 +1,30 @@
+import pytest
+
+from utils.automata_svg import UnsupportedAutomaton, render_automaton
+
+TWO_STATES = r"""
+\node[state, initial] (q0) {$q_0$};
+\node[state, accepting] (q1) [right=of q0] {$q_1$};
+"""
+
+
+def test_supported_subset_renders():
+    svg = render_automaton(None, TWO_STATES + r"\path (q0) edge [bend left] node {a} (q1);")
+    assert svg.startswith("<svg")
+
+
+@pytest.mark.parametrize(
+    "options, contents",
+    [
+        # macros TeX expands but the native renderer cannot
+        (None, TWO_STATES + r"\path (q0) edge [bend left=\ang] node {a} (q1);"),
+        (r"bend angle=\x", TWO_STATES),
+        # a key without the value the native renderer needs
+        (None, TWO_STATES + r"\path (q0) edge node[pos] {x} (q1);"),
+        # the statement ends before the edge has a target
+        (None, TWO_STATES + r"\path (q0) edge node {a};"),
+    ],
+)
+def test_unexpected_tikz_falls_back_to_tex(options, contents):
+    with pytest.raises(UnsupportedAutomaton):
+        render_automaton(options, contents)
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+from utils.prefetch import Prefetcher, wait
+
+HOOKS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "hooks")
+
+# loads utils like MkDocs loads a hook, then takes the hooks off sys.path again
+SPAWN = f"""
+import multiprocessing
+import sys
+
+if __name__ == "__main__":
+    multiprocessing.set_start_method("spawn")
+    sys.path.insert(0, {HOOKS_DIR!r})
+    from utils.page_cache import fingerprint
+    from utils.prefetch import Prefetcher
+    del sys.path[0]
+
+    prefetcher = Prefetcher(2)
+    print(prefetcher.process(fingerprint, "a", "b").result(timeout=60) == fingerprint("a", "b"))
+    prefetcher.shutdown()
+"""
+
+
+def test_process_spawn(tmp_path):
+    script = tmp_path / "spawn.py"
+    script.write_text(SPAWN, encoding="utf-8")
+    result = subprocess.run(
+        [sys.executable, str(script)], capture_output=True, text=True, cwd=tmp_path, timeout=120
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "True"
+
+
+def test_process_broken_pool():
+    prefetcher = Prefetcher(1)
+    try:
+        assert wait(prefetcher.process(os._exit, 1)) is None
+        # the pool is broken now, later work fails without raising
+        assert wait(prefetcher.process(abs, -1)) is None
+        assert prefetcher.process(abs, -1).exception() is not None
+    finally:
+        prefetcher.shutdown()
@@ -0,0 +1,30 @@
+import json
+import os
+import threading
+
+from utils.svg_cache import SVGCache
+
+
+def test_put_while_saving(tmp_path):
+    cache = SVGCache(str(tmp_path))
+    cache.save()
+    keys = [[SVGCache.key(str(thread), str(i)) for i in range(200)] for thread in range(4)]
+
+    def put(keys):
+        for key in keys:
+            cache.put(key, "<svg/>")
+
+    # like the background renders of `mkdocs serve` next to the build thread
+    threads = [threading.Thread(target=put, args=(batch,)) for batch in keys]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        cache.evict(1 << 30)
+        cache.save()
+    for thread in threads:
+        thread.join()
+    cache.save()
+
+    with open(os.path.join(tmp_path, SVGCache.MANIFEST), "r", encoding="utf-8") as f:
+        entries = json.load(f)["entries"]
+    assert set(entries) == {key for batch in keys for key in batch}